@@ -1,7 +1,10 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from core.views import instrumentation_report
+
 urlpatterns = [
     path('api/', include("core.urls")),
+    path('instrumentation/', admin.site.admin_view(instrumentation_report), name="instrumentation"),
     path('', admin.site.urls)
 ]
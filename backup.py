@@ -1,11 +1,26 @@
+import io
 import os
+import json
 import time
+import zlib
+import hashlib
+import argparse
+import contextlib
 import yadisk
+import shutil
+import tarfile
 import schedule
 import datetime
+import tempfile
+import threading
 import subprocess
 from app.settings import DATABASES
 
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
 
 YA_DISK_CONFIG = {
     "app_id": "XXX",
@@ -14,42 +29,479 @@ YA_DISK_CONFIG = {
     "backup_path": "cproject_backup"
 }
 PG_DUMP_BIN_PATH = r'"C:\Program Files\PostgreSQL\17\bin\pg_dump.exe"'
+PG_DUMP_FORMAT = "custom"  # custom - один поток через stdout, directory - параллельный дамп с -j
+PG_DUMP_JOBS = 4
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_COMPRESS_LEVEL = 6
+
+# Инкрементальные бэкапы: plain-дамп режется на чанки по границам строк, которые определяются
+# содержимым (crc32 строки), поэтому вставка строк меняет только соседние чанки
+CHUNK_MASK = (1 << 13) - 1
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKS_DIR = "chunks"
+MANIFESTS_DIR = "manifests"
+RETENTION = {"hourly": 24, "daily": 7, "weekly": 4}
+BACKUP_LOCK_FILE = os.path.join(tempfile.gettempdir(), "cproject_backup.lock")
+BACKUP_VERIFY_DATABASE = "cproject_restore_check"
+
+
+class BackupMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.sizes = {}
+
+    @contextlib.contextmanager
+    def measure(self, stage: str, size: int = 0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[stage] = self.durations.get(stage, 0) + time.perf_counter() - started
+            self.sizes[stage] = self.sizes.get(stage, 0) + size
+
+    def timed(self, stage: str, chunks):
+        chunks = iter(chunks)
+        while True:
+            started = time.perf_counter()
+            chunk = next(chunks, None)
+            self.durations[stage] = self.durations.get(stage, 0) + time.perf_counter() - started
+            if chunk is None:
+                return
+            self.sizes[stage] = self.sizes.get(stage, 0) + len(chunk)
+            yield chunk
+
+    def summary(self):
+        result = {"total_seconds": round(time.perf_counter() - self.started, 3)}
+        for stage, duration in self.durations.items():
+            size = self.sizes.get(stage, 0)
+            result[stage] = {
+                "seconds": round(duration, 3),
+                "bytes": size,
+                "mb_per_second": round(size / duration / 1024 / 1024, 2) if duration and size else None,
+            }
+        return result
+
+
+class ChunkStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self.buffer:
+            self.buffer = next(self.chunks, None)
+            if self.buffer is None:
+                self.buffer = b""
+                return 0
+        size = min(len(b), len(self.buffer))
+        b[:size], self.buffer = self.buffer[:size], self.buffer[size:]
+        return size
+
+
+class LocalStorage:
+    def __init__(self, path: str):
+        self.path = path
+
+    def upload(self, stream, name: str):
+        target = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(f"{target}.part", "wb") as f:
+            shutil.copyfileobj(stream, f, BACKUP_CHUNK_SIZE)
+        os.replace(f"{target}.part", target)
+        return target
+
+    def read(self, name: str):
+        with open(os.path.join(self.path, name), "rb") as f:
+            return f.read()
+
+    def list(self, directory: str):
+        path = os.path.join(self.path, directory)
+        return sorted(n for n in os.listdir(path) if not n.endswith(".part")) if os.path.isdir(path) else []
+
+    def remove(self, name: str):
+        os.remove(os.path.join(self.path, name))
+
+
+class YandexDiskStorage:
+    def __init__(self, config: dict):
+        self.client = yadisk.Client(config['app_id'], config['app_secret'], config['token'])
+        self.path = config['backup_path']
+        self.directories = set()
+
+    def upload(self, stream, name: str):
+        directory = os.path.dirname(f"{self.path}/{name}")
+        if directory not in self.directories:
+            if not self.client.exists(directory):
+                self.client.makedirs(directory)
+            self.directories.add(directory)
+        return self.client.upload(stream, f"{self.path}/{name}", overwrite=True).href
+
+    def read(self, name: str):
+        buffer = io.BytesIO()
+        self.client.download(f"{self.path}/{name}", buffer)
+        return buffer.getvalue()
 
+    def list(self, directory: str):
+        if not self.client.exists(f"{self.path}/{directory}"):
+            return []
+        return sorted(item.name for item in self.client.listdir(f"{self.path}/{directory}"))
 
-def get_dump(host: str, port: int, username: str, password: str, db_name: str):
+    def remove(self, name: str):
+        self.client.remove(f"{self.path}/{name}", permanently=True)
+
+
+def get_dump_command(host: str, port: int, username: str, db_name: str, dump_format: str, output: str = None, jobs: int = 1):
+    command = [r'pg_dump', "-h", host, "-p", str(port), "-U", username]
+    if dump_format == "directory":
+        command += ["-Fd", "-j", str(jobs), "-f", output]
+    elif dump_format == "plain":
+        command += ["-Fp"]
+    else:
+        command += ["-Fc", "-Z0"]
+    return command + [db_name]
+
+
+def read_chunks(fileobj):
+    return iter(lambda: fileobj.read(BACKUP_CHUNK_SIZE), b"")
+
+
+def gzip_chunks(chunks, level: int = BACKUP_COMPRESS_LEVEL, metrics=None):
+    metrics = metrics or BackupMetrics()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        with metrics.measure("compress", len(chunk)):
+            data = compressor.compress(chunk)
+        if data:
+            yield data
+    with metrics.measure("compress"):
+        data = compressor.flush()
+    yield data
+
+
+def tar_chunks(path: str, arcname: str):
+    read_fd, write_fd = os.pipe()
+
+    def write_tar():
+        with os.fdopen(write_fd, "wb") as pipe, tarfile.open(fileobj=pipe, mode="w|") as tar:
+            tar.add(path, arcname=arcname)
+
+    writer = threading.Thread(target=write_tar, daemon=True)
+    writer.start()
+    with os.fdopen(read_fd, "rb") as pipe:
+        yield from read_chunks(pipe)
+    writer.join()
+
+
+def get_dump(host: str, port: int, username: str, password: str, db_name: str,
+             dump_format: str = PG_DUMP_FORMAT, jobs: int = PG_DUMP_JOBS, metrics=None):
+    metrics = metrics or BackupMetrics()
+    env = {**os.environ, "PGPASSWORD": password}
+    if dump_format == "directory":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output = os.path.join(tmp_dir, db_name)
+            try:
+                with metrics.measure("dump"):
+                    subprocess.run(get_dump_command(host, port, username, db_name, dump_format, output, jobs), env=env, check=True)
+            except subprocess.CalledProcessError as e:
+                raise Exception(f"Can't create dump: {e}")
+            yield from metrics.timed("archive", tar_chunks(output, db_name))
+        return
+
+    process = subprocess.Popen(get_dump_command(host, port, username, db_name, dump_format), stdout=subprocess.PIPE, env=env)
+    completed = False
     try:
-        os.environ["PGPASSWORD"] = password
-        return subprocess.check_output([
-            r'pg_dump',
-            "-h", host,
-            "-p", str(port),
-            "-U", username,
-            db_name
-        ])
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Can't create dump: {e}")
-
-
-def make_backup():
-    cloud_client = yadisk.Client(YA_DISK_CONFIG['app_id'], YA_DISK_CONFIG['app_secret'], YA_DISK_CONFIG['token'])
+        if dump_format == "plain":
+            yield from content_defined_chunks(metrics.timed("dump", process.stdout))
+        else:
+            yield from gzip_chunks(metrics.timed("dump", read_chunks(process.stdout)), metrics=metrics)
+        completed = True
+    finally:
+        process.stdout.close()
+        if not completed:
+            process.kill()
+        process.wait()
+    if process.returncode != 0:
+        raise Exception(f"Can't create dump: pg_dump exited with code {process.returncode}")
+
+
+def get_backup_name(dump_format: str = None):
+    name = f"dump_{datetime.datetime.today().strftime('%Y-%m-%d_%H-%M-%S')}"
+    if dump_format is None:
+        return name
+    return f"{name}.{'tar' if dump_format == 'directory' else 'dump.gz'}"
+
+
+def make_backup(storage=None, dump_format: str = PG_DUMP_FORMAT, jobs: int = PG_DUMP_JOBS, metrics: BackupMetrics = None):
+    storage = storage or YandexDiskStorage(YA_DISK_CONFIG)
+    metrics = metrics or BackupMetrics()
     config = DATABASES['default']
 
-    format_date = datetime.datetime.today().strftime('%Y-%m-%d_%H-%M-%S')
-    output_file = f"dump_{format_date}.sql"
-    with open(output_file, "wb") as f:
-        f.write(get_dump(config['HOST'], config['PORT'], config['USER'], config['PASSWORD'], config['NAME']))
+    chunks = get_dump(config['HOST'], config['PORT'], config['USER'], config['PASSWORD'], config['NAME'], dump_format, jobs, metrics)
+    stream = io.BufferedReader(ChunkStream(metrics.timed("output", chunks)), BACKUP_CHUNK_SIZE)
+    with metrics.measure("upload"):
+        link = storage.upload(stream, get_backup_name(dump_format))
+    # Выгрузка читает поток дампа, поэтому из ее времени вычитается время подготовки данных
+    metrics.durations["upload"] -= metrics.durations.pop("output", 0.0)
+    metrics.sizes["upload"] = metrics.sizes.pop("output", 0)
+    print("Dump successful uploaded -> ", link)
+    return link
 
-    link = cloud_client.upload(output_file, f"{YA_DISK_CONFIG['backup_path']}/{output_file}")
-    print("Dump successful uploaded to Yandex.Disk -> ", link.href)
-    os.remove(output_file)
 
+def content_defined_chunks(lines):
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= MAX_CHUNK_SIZE or (size >= MIN_CHUNK_SIZE and zlib.crc32(line) & CHUNK_MASK == 0):
+            yield b"".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b"".join(chunk)
 
-if __name__ == "__main__":
+
+def make_incremental_backup(storage=None, metrics: BackupMetrics = None):
+    # манифест записывается после чанков, поэтому чистка чанков не должна идти параллельно с бэкапом
+    with backup_lock():
+        return upload_incremental_backup(storage or YandexDiskStorage(YA_DISK_CONFIG), metrics or BackupMetrics())
+
+
+def upload_incremental_backup(storage, metrics: BackupMetrics):
+    config = DATABASES['default']
+    known_chunks = set(storage.list(CHUNKS_DIR))
+
+    manifest = {
+        "name": get_backup_name(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "chunks": [], "size": 0, "new_chunks": 0, "uploaded_bytes": 0,
+    }
+    chunks = get_dump(config['HOST'], config['PORT'], config['USER'], config['PASSWORD'], config['NAME'], "plain", metrics=metrics)
+    for chunk in chunks:
+        with metrics.measure("hash", len(chunk)):
+            digest = hashlib.sha256(chunk).hexdigest()
+        manifest["chunks"].append(digest)
+        manifest["size"] += len(chunk)
+        if f"{digest}.gz" not in known_chunks:
+            with metrics.measure("compress", len(chunk)):
+                compressed = zlib.compress(chunk, BACKUP_COMPRESS_LEVEL)
+            with metrics.measure("upload", len(compressed)):
+                storage.upload(io.BytesIO(compressed), f"{CHUNKS_DIR}/{digest}.gz")
+            known_chunks.add(f"{digest}.gz")
+            manifest["new_chunks"] += 1
+            manifest["uploaded_bytes"] += len(compressed)
+
+    storage.upload(io.BytesIO(json.dumps(manifest).encode("utf-8")), f"{MANIFESTS_DIR}/{manifest['name']}.json")
+    print(f"Incremental backup {manifest['name']}: {len(manifest['chunks'])} chunks, "
+          f"{manifest['new_chunks']} new, {manifest['uploaded_bytes']} bytes uploaded")
+    return manifest
+
+
+def get_manifest(storage, name: str):
+    return json.loads(storage.read(f"{MANIFESTS_DIR}/{name.removesuffix('.json')}.json"))
+
+
+def iter_backup_chunks(storage, manifest: dict):
+    for digest in manifest["chunks"]:
+        chunk = zlib.decompress(storage.read(f"{CHUNKS_DIR}/{digest}.gz"))
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise Exception(f"Chunk {digest} is corrupted")
+        yield chunk
+
+
+def get_psql_command(binary: str, *args):
+    config = DATABASES['default']
+    return [binary, "-h", config['HOST'], "-p", str(config['PORT']), "-U", config['USER'], *args]
+
+
+def restore_backup(storage, name: str, output=None, db_name: str = None):
+    chunks = iter_backup_chunks(storage, get_manifest(storage, name))
+    if output:
+        for chunk in chunks:
+            output.write(chunk)
+        return
+    load_dump(chunks, db_name)
+
+
+def load_dump(chunks, db_name: str = None):
+    config = DATABASES['default']
+    env = {**os.environ, "PGPASSWORD": config['PASSWORD']}
+    process = subprocess.Popen(get_psql_command(
+        r'psql', "-v", "ON_ERROR_STOP=1", "-q", db_name or config['NAME']
+    ), stdin=subprocess.PIPE, env=env)
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+    finally:
+        process.stdin.close()
+    if process.wait() != 0:
+        raise Exception(f"Can't restore dump: psql exited with code {process.returncode}")
+
+
+def verify_backup(storage, name: str, db_name: str = BACKUP_VERIFY_DATABASE):
+    env = {**os.environ, "PGPASSWORD": DATABASES['default']['PASSWORD']}
+    with tempfile.TemporaryFile() as snapshot:
+        # под блокировкой только копируются чанки: чистка могла бы удалить их посреди восстановления,
+        # а само восстановление и проверка идут без блокировки и не задерживают бэкапы
+        with backup_lock():
+            restore_backup(storage, name, output=snapshot)
+        snapshot.seek(0)
+        subprocess.run(get_psql_command(r'dropdb', "--if-exists", db_name), env=env, check=True)
+        subprocess.run(get_psql_command(r'createdb', db_name), env=env, check=True)
+        try:
+            load_dump(iter(lambda: snapshot.read(BACKUP_CHUNK_SIZE), b""), db_name)
+            tables = subprocess.run(get_psql_command(
+                r'psql', "-At", "-c", "SELECT count(*) FROM information_schema.tables WHERE table_schema = 'public'", db_name
+            ), env=env, check=True, capture_output=True, text=True).stdout.strip()
+            if not tables or int(tables) == 0:
+                raise Exception(f"Restored backup {name} has no tables")
+            return int(tables)
+        finally:
+            subprocess.run(get_psql_command(r'dropdb', "--if-exists", db_name), env=env)
+
+
+held_locks = threading.local()
+
+
+@contextlib.contextmanager
+def backup_lock(path: str = BACKUP_LOCK_FILE):
+    # блокировку держит ОС, пока файл открыт: она снимается и при падении процесса,
+    # поэтому долгий бэкап не считается зависшим, а файл блокировки не удаляется
+    held = held_locks.__dict__.setdefault("paths", set())
+    if path in held:
+        # повторный вход из того же потока, например apply_retention внутри задачи службы
+        yield
+        return
+    f = open(path, "a+")
+    try:
+        try:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            raise BlockingIOError(f"Backup is already running ({path})")
+        try:
+            f.seek(0)
+            f.truncate()
+            f.write(str(os.getpid()))
+            f.flush()
+            held.add(path)
+            yield
+        finally:
+            held.discard(path)
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    finally:
+        f.close()
+
+
+def get_backup_date(name: str):
+    return datetime.datetime.strptime(name.removesuffix(".json").removeprefix("dump_"), '%Y-%m-%d_%H-%M-%S')
+
+
+def select_backups_to_keep(names, retention: dict = None):
+    retention = retention or RETENTION
+    buckets = {
+        "hourly": lambda d: (d.date(), d.hour),
+        "daily": lambda d: d.date(),
+        "weekly": lambda d: d.isocalendar()[:2],
+    }
+    seen = {tier: set() for tier in buckets}
+    keep = set()
+    for name in sorted(names, key=get_backup_date, reverse=True):
+        backup_date = get_backup_date(name)
+        for tier, bucket in buckets.items():
+            key = bucket(backup_date)
+            if key not in seen[tier] and len(seen[tier]) < retention.get(tier, 0):
+                seen[tier].add(key)
+                keep.add(name)
+    return keep
+
+
+def apply_retention(storage=None, retention: dict = None):
+    storage = storage or YandexDiskStorage(YA_DISK_CONFIG)
+    # чанки еще не записавшего манифест бэкапа ни на что не ссылаются и были бы удалены
+    with backup_lock():
+        return remove_expired_backups(storage, retention)
+
+
+def remove_expired_backups(storage, retention: dict = None):
+    manifests = storage.list(MANIFESTS_DIR)
+    keep = select_backups_to_keep(manifests, retention)
+    for name in manifests:
+        if name not in keep:
+            storage.remove(f"{MANIFESTS_DIR}/{name}")
+
+    used_chunks = {f"{digest}.gz" for name in keep for digest in get_manifest(storage, name)["chunks"]}
+    removed_chunks = 0
+    for name in storage.list(CHUNKS_DIR):
+        if name not in used_chunks:
+            storage.remove(f"{CHUNKS_DIR}/{name}")
+            removed_chunks += 1
+    print(f"Retention: {len(keep)} backups kept, {len(manifests) - len(keep)} removed, {removed_chunks} chunks removed")
+    return keep
+
+
+def run_scheduled_backup(storage=None):
+    storage = storage or YandexDiskStorage(YA_DISK_CONFIG)
+    make_incremental_backup(storage)
+    apply_retention(storage)
+
+
+def run_scheduler(storage=None):
     print("Making first backup force...")
-    make_backup()
+    run_scheduled_backup(storage)
 
     print("\nBackup scheduler started")
-    schedule.every(1).hours.do(make_backup)
+    schedule.every(1).hours.do(run_scheduled_backup, storage)
     while True:
         schedule.run_pending()
         time.sleep(1)
+
+
+def get_storage(path: str = None):
+    return LocalStorage(path) if path else YandexDiskStorage(YA_DISK_CONFIG)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Резервное копирование базы данных")
+    parser.add_argument("--local", help="Каталог локального хранилища вместо Яндекс.Диска")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("schedule", help="Ежечасные инкрементальные бэкапы (по умолчанию)")
+    full = commands.add_parser("full", help="Полный бэкап")
+    full.add_argument("--format", choices=["custom", "directory"], default=PG_DUMP_FORMAT)
+    full.add_argument("--jobs", type=int, default=PG_DUMP_JOBS)
+    commands.add_parser("incremental", help="Инкрементальный бэкап")
+    commands.add_parser("prune", help="Удалить бэкапы по политике хранения")
+    commands.add_parser("list", help="Список инкрементальных бэкапов")
+    restore = commands.add_parser("restore", help="Восстановить инкрементальный бэкап")
+    restore.add_argument("name")
+    restore.add_argument("-o", "--output", help="Записать SQL в файл вместо загрузки в базу")
+    restore.add_argument("--database", help="База данных для восстановления")
+    args = parser.parse_args()
+
+    storage = get_storage(args.local)
+    if args.command == "full":
+        make_backup(storage, args.format, args.jobs)
+    elif args.command == "incremental":
+        make_incremental_backup(storage)
+    elif args.command == "prune":
+        apply_retention(storage)
+    elif args.command == "list":
+        print("\n".join(storage.list(MANIFESTS_DIR)))
+    elif args.command == "restore":
+        if args.output:
+            with open(args.output, "wb") as f:
+                restore_backup(storage, args.name, f)
+        else:
+            restore_backup(storage, args.name, db_name=args.database)
+    else:
+        run_scheduler(storage)
@@ -1,20 +1,57 @@
 from .models import *
 
 from django.db import transaction
-from django.db.models import Q, Value
-from django.db.models.functions import Concat
-from django.urls import reverse
-from django.contrib import admin
-from django.utils.html import format_html
+from django.urls import reverse, path
+from django.http import Http404, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
+from django.core.exceptions import PermissionDenied
+from django import forms
+from django.contrib import admin, messages
+from django.utils.html import format_html, format_html_join
 from django.contrib.auth.admin import UserAdmin
 from django.utils.safestring import mark_safe
 
-from .utils import check_permission
+from .approvals import approve_transactions, summarize_approval, APPROVED, REJECTED
+from .references import references
+from .jobs import enqueue_reports_archive
+from .search import client_search_q
+from .utils import check_permission, is_lazy_schedule, get_payment_schedule, materialize_payment
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    def cache_choices(self):
+        self._cached_choices = list(super()._get_choices())
+        self.widget.choices = self._cached_choices
+
+    def _get_choices(self):
+        if hasattr(self, '_cached_choices'):
+            return self._cached_choices
+        return super()._get_choices()
+
+    choices = property(_get_choices, forms.ChoiceField.choices.fset)
+
+
+class QueryProfileMixin:
+    cached_choice_fields = []
+    choice_select_related = {}
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.choice_select_related:
+            kwargs['queryset'] = db_field.remote_field.model.objects.select_related(
+                *self.choice_select_related[db_field.name]
+            )
+        if db_field.name in self.cached_choice_fields:
+            kwargs['form_class'] = CachedModelChoiceField
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if db_field.name in self.cached_choice_fields:
+            formfield.cache_choices()
+        return formfield
 
 
 class ManagerAdmin(UserAdmin):
     model = Manager
     list_display = ['username', 'contact', 'role']
+    list_select_related = ['contact', 'role']
     list_filter = ['role']
     fieldsets = (
         (None, {'fields': ('username', 'password')}),
@@ -39,6 +76,9 @@ class ProductInline(admin.TabularInline):
     can_delete = False
     readonly_fields = ['type', 'status', 'amount', 'interest_rate', 'duration', 'open_product']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('type', 'status')
+
     def open_product(self, obj):
         url = reverse('admin:core_product_change', args=[obj.id])
         return format_html(
@@ -55,35 +95,18 @@ class ClientAdmin(admin.ModelAdmin):
         return super().has_delete_permission(request, obj)
 
     inlines = [ProductInline]
-    search_fields = [
-        'contact__name',
-        'contact__phone',
-        'contact__passport_series',
-        'contact__passport_number',
-        'work_place',
-        'birth_date',
-        'passport_full_s',
-        'passport_full',
-    ]
+    search_fields = ['search_document']
 
     def get_search_results(self, request, queryset, search_term):
         if search_term:
-            queryset = queryset.annotate(
-                passport_full_s=Concat('contact__passport_series', Value(' '), 'contact__passport_number'),
-                passport_full=Concat('contact__passport_series', 'contact__passport_number'),
-            ).filter(
-                Q(contact__name__icontains=search_term) |
-                Q(contact__phone__icontains=search_term) |
-                Q(contact__passport_series__icontains=search_term) |
-                Q(contact__passport_number__icontains=search_term) |
-                Q(passport_full_s__icontains=search_term) |
-                Q(passport_full__icontains=search_term) |
-                Q(work_place__icontains=search_term) |
-                Q(birth_date__icontains=search_term)
-            )
-        return super().get_search_results(request, queryset, search_term)
+            return queryset.filter(client_search_q(search_term, id_fields=['id'])), False
+        return queryset, False
 
-    list_display = ['__str__', 'birth_date', 'gender', 'salary', 'work_place']
+    list_display = [
+        '__str__', 'birth_date', 'gender', 'salary', 'work_place', 'portfolio__credit_debt',
+        'portfolio__deposit_balance', 'portfolio__overdue_count', 'portfolio__next_due_date'
+    ]
+    list_select_related = ['contact', 'portfolio']
 
     class BirthDateRangeFilter(admin.SimpleListFilter):
         title = 'Диапазон дат рождения'
@@ -106,18 +129,19 @@ class ClientAdmin(admin.ModelAdmin):
     list_filter = ['gender', BirthDateRangeFilter]
 
 
-class PaymentScheduleInline(admin.TabularInline):
+class PaymentScheduleInline(QueryProfileMixin, admin.TabularInline):
     model = PaymentSchedule
     extra = 0
     fields = ['amount', 'scheduled_date', 'actual_date', 'status', 'create_transaction']
     readonly_fields = ['create_transaction']
+    cached_choice_fields = ['status']
 
     def create_transaction(self, obj):
         if obj.pk:
-            if obj.transaction:
+            if obj.transaction_id:
                 return format_html('<span>Транзакция создана</span>')
             url = reverse('admin:core_transaction_add')
-            params = f"?payment_schedule={obj.id}&product={obj.product.id}&client={obj.product.client.id}&amount={obj.amount}"
+            params = f"?payment_schedule={obj.id}&product={obj.product_id}&client={obj.client_id}&amount={obj.amount}"
             return format_html(
                 '<a class="button" href="{}{}">Создать транзакцию</a>',
                 url,
@@ -128,47 +152,101 @@ class PaymentScheduleInline(admin.TabularInline):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(QueryProfileMixin, admin.ModelAdmin):
     inlines = [PaymentScheduleInline]
+    choice_select_related = {'client': ['contact']}
     readonly_fields_on_update = ['client', 'type', 'amount', 'interest_rate', 'duration', 'created_at', 'download_schedule']
 
     def get_readonly_fields(self, request, obj=None):
         if obj and not request.user.is_superuser:
-            return self.readonly_fields_on_update + list(super().get_readonly_fields(request, obj))
-        return super().get_readonly_fields(request, obj)
+            fields = self.readonly_fields_on_update + list(super().get_readonly_fields(request, obj))
+        else:
+            fields = list(super().get_readonly_fields(request, obj))
+        if obj and is_lazy_schedule(obj):
+            fields.append('payment_schedule_table')
+        return fields
 
     def has_delete_permission(self, request, obj=None):
         if not request.user.is_superuser:
             return False
         return super().has_delete_permission(request, obj)
 
-    search_fields = [
-        'id',
-        'client__id',
-        'client__contact__name',
-        'client__contact__phone',
-        'client__contact__passport_series',
-        'client__contact__passport_number',
-        'passport_full',
-        'passport_full_s',
-    ]
-    list_display = ['id', 'type', 'status', 'client', 'amount', 'interest_rate', 'duration', 'created_at']
-    list_filter = ['type', 'status', 'created_at']
+    def get_urls(self):
+        return [
+            path(
+                '<int:product_id>/payment/<int:installment>/', self.admin_site.admin_view(self.edit_payment),
+                name='core_product_edit_payment'
+            ),
+        ] + super().get_urls()
+
+    def edit_payment(self, request, product_id, installment):
+        product = get_object_or_404(Product.objects.select_related('type'), id=product_id)
+        if not self.has_change_permission(request, product):
+            raise PermissionDenied()
+        # рассчитанный платеж сохраняется перед редактированием
+        payment = materialize_payment(product, installment)
+        if payment is None:
+            raise Http404()
+        return HttpResponseRedirect(reverse('admin:core_paymentschedule_change', args=[payment.id]))
+
+    def payment_schedule_table(self, obj):
+        rows = []
+        for payment in get_payment_schedule(obj):
+            status = references.get(PaymentStatus, payment.status_id)
+            if payment.transaction_id:
+                actions = format_html('<span>Транзакция создана</span>')
+            else:
+                if payment.pk:
+                    edit_url = reverse('admin:core_paymentschedule_change', args=[payment.pk])
+                    params = f"?payment_schedule={payment.pk}"
+                else:
+                    edit_url = reverse('admin:core_product_edit_payment', args=[obj.id, payment.installment])
+                    params = f"?installment={payment.installment}"
+                actions = format_html(
+                    '<a class="button" style="margin-right: 5px" href="{}">Изменить</a>'
+                    '<a class="button" href="{}{}&product={}&client={}&amount={}">Создать транзакцию</a>',
+                    edit_url, reverse('admin:core_transaction_add'), params, obj.id, obj.client_id, payment.amount
+                )
+            rows.append((
+                payment.installment or "-", payment.scheduled_date, payment.amount, payment.actual_date or "-",
+                status.name if status else "-", actions
+            ))
+        return format_html(
+            '<table><thead><tr><th>№</th><th>Дата платежа</th><th>Сумма</th><th>Фактическая дата</th><th>Статус</th>'
+            '<th></th></tr></thead><tbody>{}</tbody></table>',
+            format_html_join('', '<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>', rows)
+        )
+    payment_schedule_table.short_description = "График платежей"
+
+    search_fields = ['client__search_document']
 
     def get_search_results(self, request, queryset, search_term):
         if search_term:
-            queryset = queryset.annotate(
-                passport_full_s=Concat('client__contact__passport_series', Value(' '), 'client__contact__passport_number'),
-                passport_full=Concat('client__contact__passport_series', 'client__contact__passport_number'),
-            ).filter(
-                Q(client__contact__name__icontains=search_term) |
-                Q(client__contact__phone__icontains=search_term) |
-                Q(passport_full_s__icontains=search_term) |
-                Q(passport_full__icontains=search_term) |
-                Q(client__id__icontains=search_term) |
-                Q(id__icontains=search_term)
-            )
-        return super().get_search_results(request, queryset, search_term)
+            return queryset.filter(client_search_q(search_term, 'client__', id_fields=['id', 'client_id'])), False
+        return queryset, False
+
+    list_display = [
+        'id', 'type', 'status', 'client', 'amount', 'interest_rate', 'duration', 'created_at',
+        'portfolio__principal_balance', 'portfolio__overdue_count'
+    ]
+    list_select_related = ['type', 'status', 'client__contact', 'portfolio']
+    list_filter = ['type', 'status', 'created_at']
+    actions = ['export_pdf_reports', 'export_csv_reports']
+
+    def export_reports(self, request, queryset, report_type):
+        # архив формируется обработчиком очереди отчетов, а не в запросе
+        job = enqueue_reports_archive(queryset, report_type, request.user)
+        self.message_user(request, format_html(
+            'Архив поставлен в очередь: <a href="{}">{}</a>', reverse('report_job_download', args=[job.id]), job
+        ))
+
+    def export_pdf_reports(self, request, queryset):
+        return self.export_reports(request, queryset, 'pdf')
+    export_pdf_reports.short_description = "Скачать графики платежей (PDF, ZIP)"
+
+    def export_csv_reports(self, request, queryset):
+        return self.export_reports(request, queryset, 'csv')
+    export_csv_reports.short_description = "Скачать графики платежей (CSV, ZIP)"
 
     def download_schedule(self, obj):
         if obj.pk:
@@ -182,50 +260,38 @@ class ProductAdmin(admin.ModelAdmin):
     download_schedule.short_description = "Сформировать отчет"
 
 @admin.register(PaymentSchedule)
-class PaymentScheduleAdmin(admin.ModelAdmin):
-    search_fields = [
-        'product__client__contact__name',
-        'product__client__contact__phone',
-        'passport_full_s',
-        'passport_full',
-        'product__client__contact__passport_series',
-        'product__client__contact__passport_number',
-        'product__client__id',
-        'product__client__id',
-        'product__id',
-        'id',
-    ]
-    list_display = ['product', 'amount', 'scheduled_date', 'actual_date', 'status', 'create_transaction_button']
-    list_filter = ['status', 'scheduled_date', 'actual_date']
+class PaymentScheduleAdmin(QueryProfileMixin, admin.ModelAdmin):
+    choice_select_related = {'product': ['type'], 'transaction': ['status']}
+    search_fields = ['client__search_document']
 
     def get_search_results(self, request, queryset, search_term):
         if search_term:
-            queryset = queryset.annotate(
-                passport_full_s=Concat('product__client__contact__passport_series', Value(' '), 'product__client__contact__passport_number'),
-                passport_full=Concat('product__client__contact__passport_series', 'product__client__contact__passport_number'),
-            ).filter(
-                Q(product__client__contact__name__icontains=search_term) |
-                Q(product__client__contact__phone__icontains=search_term) |
-                Q(passport_full_s__icontains=search_term) |
-                Q(passport_full__icontains=search_term) |
-                Q(product__client__id__icontains=search_term) |
-                Q(id__icontains=search_term)
-            )
-        return super().get_search_results(request, queryset, search_term)
+            return queryset.filter(client_search_q(
+                search_term, 'client__', id_fields=['id', 'product_id', 'client_id']
+            )), False
+        return queryset, False
+
+    list_display = ['product', 'contact', 'amount', 'scheduled_date', 'actual_date', 'status', 'create_transaction_button']
+    list_select_related = ['product__type', 'contact', 'status']
+    list_filter = ['status', 'scheduled_date', 'actual_date']
+    # сортировка и фильтр по ключу секционирования позволяют читать только нужные партиции
+    ordering = ['-scheduled_date', '-id']
+    show_full_result_count = False
 
     def create_transaction_button(self, obj):
-        if obj.transaction:
+        if obj.transaction_id:
             return format_html('<span>Транзакция создана</span>')
         url = reverse('admin:core_transaction_add')
         return format_html(
             '<a class="button" href="{}?payment_schedule={}&client={}&product={}&amount={}">Создать транзакцию</a>',
-            url, obj.id, obj.product.client.id, obj.product.id, obj.amount
+            url, obj.id, obj.client_id, obj.product_id, obj.amount
         )
     create_transaction_button.short_description = "Действия"
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
-    readonly_fields = ['date']
+class TransactionAdmin(QueryProfileMixin, admin.ModelAdmin):
+    choice_select_related = {'client': ['contact'], 'product': ['type']}
+    readonly_fields = ['date', 'approved_status', 'approve_buttons_editor']
     fields = ['client', 'product', 'amount', 'type', 'status']
     readonly_fields_on_update = ['client', 'product', 'amount', 'type', 'date', 'approved_status']
 
@@ -245,21 +311,46 @@ class TransactionAdmin(admin.ModelAdmin):
             return False
         return super().has_delete_permission(request, obj)
 
-    search_fields = [
-        'client__contact__name',
-        'client__contact__phone',
-        'passport_full_s',
-        'passport_full',
-        'client__id',
-        'product__id',
-        'id',
-    ]
+    search_fields = ['client__search_document']
+
+    def get_search_results(self, request, queryset, search_term):
+        if search_term:
+            return queryset.filter(client_search_q(
+                search_term, 'client__', id_fields=['id', 'client_id', 'product_id']
+            )), False
+        return queryset, False
+
     list_display = ['id', 'product', 'amount', 'type', 'date', 'status', 'approved_status']
+    list_select_related = ['product__type', 'type', 'status']
     list_filter = ['type', 'status', 'date', 'approved']
+    ordering = ['-date', '-id']
+    show_full_result_count = False
 
     def get_list_display(self, request, obj=None):
         return self.list_display + (['approve_buttons'] if check_permission('approve_transaction', request.user) else [])
 
+    actions = ['approve_selected', 'reject_selected']
+
+    def has_approve_permission(self, request):
+        return check_permission('approve_transaction', request.user)
+
+    def process_selected(self, request, queryset, approve):
+        results = approve_transactions(queryset.values_list('id', flat=True), approve, request.user)
+        skipped = [str(i) for i, result in results.items() if result not in (APPROVED, REJECTED)]
+        self.message_user(request, f"Транзакций обработано: {summarize_approval(results)}")
+        if skipped:
+            self.message_user(request, f"Пропущены уже обработанные транзакции: {', '.join(skipped)}", messages.WARNING)
+
+    def approve_selected(self, request, queryset):
+        self.process_selected(request, queryset, True)
+    approve_selected.short_description = "Одобрить выбранные транзакции"
+    approve_selected.allowed_permissions = ['approve']
+
+    def reject_selected(self, request, queryset):
+        self.process_selected(request, queryset, False)
+    reject_selected.short_description = "Отклонить выбранные транзакции"
+    reject_selected.allowed_permissions = ['approve']
+
     def approve_buttons_editor(self, obj):
         if obj and obj.pk:
             return mark_safe(self.approve_buttons(obj))
@@ -282,28 +373,13 @@ class TransactionAdmin(admin.ModelAdmin):
         return "Обработано"
     approve_buttons.short_description = ""
 
-
-    def get_search_results(self, request, queryset, search_term):
-        if search_term:
-            queryset = queryset.annotate(
-                passport_full_s=Concat('client__contact__passport_series', Value(' '), 'client__contact__passport_number'),
-                passport_full=Concat('client__contact__passport_series', 'client__contact__passport_number'),
-            ).filter(
-                Q(client__contact__name__icontains=search_term) |
-                Q(client__contact__phone__icontains=search_term) |
-                Q(passport_full_s__icontains=search_term) |
-                Q(passport_full__icontains=search_term) |
-                Q(client__id__icontains=search_term) |
-                Q(product__id__icontains=search_term) |
-                Q(id__icontains=search_term)
-            )
-        return super().get_search_results(request, queryset, search_term)
-
     def add_view(self, request, form_url='', extra_context=None):
         payment_schedule_id = request.GET.get('payment_schedule')
-        print(payment_schedule_id)
         if payment_schedule_id:
             request.session['payment_schedule_id'] = payment_schedule_id
+        installment, product_id = request.GET.get('installment', ''), request.GET.get('product', '')
+        if installment.isdigit() and product_id.isdigit():
+            request.session['payment_installment'] = [int(product_id), int(installment)]
         return super().add_view(request, form_url, extra_context)
 
     def save_model(self, request, obj, form, change):
@@ -311,18 +387,60 @@ class TransactionAdmin(admin.ModelAdmin):
             super().save_model(request, obj, form, change)
 
             payment_schedule_id = request.session.pop('payment_schedule_id', None)
+            payment_installment = request.session.pop('payment_installment', None)
+            payment_schedule = None
             if payment_schedule_id:
-                try:
-                    payment_schedule = PaymentSchedule.objects.get(id=payment_schedule_id)
-                    payment_schedule.transaction = obj
-                    payment_schedule.status = PaymentStatus.objects.get_or_create(
-                        name="Просрочен" if obj.date.date() > payment_schedule.scheduled_date else "Оплачен"
-                    )[0]
-                    payment_schedule.save()
-                except PaymentSchedule.DoesNotExist:
-                    pass
-
-admin.site.register(Role)
+                payment_schedule = PaymentSchedule.objects.filter(id=payment_schedule_id).first()
+            elif payment_installment and payment_installment[0] == obj.product_id:
+                payment_schedule = materialize_payment(obj.product, payment_installment[1])
+
+            if payment_schedule is not None:
+                payment_schedule.transaction = obj
+                payment_schedule.status = references.get_or_create(
+                    PaymentStatus, "Просрочен" if obj.date.date() > payment_schedule.scheduled_date else "Оплачен"
+                )
+                payment_schedule.save()
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'product', 'report_type', 'status', 'requested_by', 'created_at', 'wait', 'run', 'download']
+    list_filter = ['status', 'report_type', 'created_at']
+    list_select_related = ['product__type', 'requested_by__contact']
+    readonly_fields = [
+        'product', 'products_count', 'report_type', 'status', 'requested_by', 'file', 'error',
+        'created_at', 'started_at', 'finished_at', 'wait', 'run', 'download'
+    ]
+    # в архив могут входить тысячи продуктов, поэтому на странице показывается только их количество
+    exclude = ['products']
+
+    def has_add_permission(self, request):
+        return False
+
+    def products_count(self, obj):
+        return obj.products.count() if obj.is_archive else "-"
+    products_count.short_description = "Продуктов в архиве"
+
+    def wait(self, obj):
+        return f"{obj.wait_time:.2f} с" if obj.wait_time is not None else "-"
+    wait.short_description = "Ожидание в очереди"
+
+    def run(self, obj):
+        return f"{obj.run_time:.2f} с" if obj.run_time is not None else "-"
+    run.short_description = "Время формирования"
+
+    def download(self, obj):
+        if obj.status == ReportJob.DONE:
+            return format_html('<a class="button" href="{}">Скачать</a>', reverse('report_job_download', args=[obj.id]))
+        return obj.get_status_display()
+    download.short_description = "Отчет"
+
+@admin.register(Role)
+class RoleAdmin(admin.ModelAdmin):
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.name == 'permissions':
+            kwargs['queryset'] = Permission.objects.select_related('content_type')
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
 admin.site.register(ProductType)
 admin.site.register(ProductStatus)
 admin.site.register(PaymentStatus)
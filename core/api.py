@@ -0,0 +1,147 @@
+import base64
+import binascii
+from typing import NamedTuple
+
+from django.utils.dateparse import parse_date
+
+from core.models import (
+    Client, Product, PaymentSchedule, Transaction, PaymentStatus, ProductStatus, ProductType, TransactionStatus,
+    TransactionType
+)
+from core.references import references
+
+
+class ApiError(Exception):
+    pass
+
+
+class Resource(NamedTuple):
+    model: type
+    fields: dict
+    filters: dict
+
+
+RESOURCES = {
+    'clients': Resource(Client, {
+        'id': 'id',
+        'name': 'contact__name',
+        'phone': 'contact__phone',
+        'birth_date': 'birth_date',
+        'gender': 'gender',
+        'work_place': 'work_place',
+        'salary': 'salary',
+        'credit_debt': 'portfolio__credit_debt',
+        'deposit_balance': 'portfolio__deposit_balance',
+        'overdue_count': 'portfolio__overdue_count',
+    }, {}),
+    'products': Resource(Product, {
+        'id': 'id',
+        'client': 'client_id',
+        'type': ('type_id', ProductType),
+        'status': ('status_id', ProductStatus),
+        'amount': 'amount',
+        'interest_rate': 'interest_rate',
+        'duration': 'duration',
+        'created_at': 'created_at',
+        'principal_balance': 'portfolio__principal_balance',
+        'next_due_date': 'portfolio__next_due_date',
+        'overdue_count': 'portfolio__overdue_count',
+    }, {
+        'client': ('client_id', int),
+        'type': ('type_id', int),
+        'status': ('status_id', int),
+    }),
+    'schedules': Resource(PaymentSchedule, {
+        'id': 'id',
+        'product': 'product_id',
+        'client': 'client_id',
+        'installment': 'installment',
+        'amount': 'amount',
+        'scheduled_date': 'scheduled_date',
+        'actual_date': 'actual_date',
+        'status': ('status_id', PaymentStatus),
+        'transaction': 'transaction_id',
+    }, {
+        'product': ('product_id', int),
+        'client': ('client_id', int),
+        'status': ('status_id', int),
+        'date_from': ('scheduled_date__gte', parse_date),
+        'date_to': ('scheduled_date__lte', parse_date),
+        'unpaid': ('transaction__isnull', lambda v: v == '1'),
+    }),
+    'transactions': Resource(Transaction, {
+        'id': 'id',
+        'client': 'client_id',
+        'product': 'product_id',
+        'amount': 'amount',
+        'type': ('type_id', TransactionType),
+        'status': ('status_id', TransactionStatus),
+        'date': 'date',
+        'approved': 'approved',
+        'approved_by': 'approved_by_id',
+    }, {
+        'client': ('client_id', int),
+        'product': ('product_id', int),
+        'status': ('status_id', int),
+        'date_from': ('date__date__gte', parse_date),
+        'date_to': ('date__date__lte', parse_date),
+        'pending': ('approved__isnull', lambda v: v == '1'),
+    }),
+}
+
+
+def encode_cursor(last_id: int):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode())
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ApiError("Некорректный курсор.")
+
+
+def select_fields(resource: Resource, fields: str = None):
+    if not fields:
+        return list(resource.fields)
+    selected = list(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+    unknown = [f for f in selected if f not in resource.fields]
+    if unknown:
+        raise ApiError(f"Неизвестные поля: {', '.join(unknown)}.")
+    return ['id'] + [f for f in selected if f != 'id']
+
+
+def filter_queryset(resource: Resource, params):
+    queryset = resource.model.objects.all()
+    for param, (lookup, parse) in resource.filters.items():
+        if params.get(param):
+            try:
+                value = parse(params[param])
+            except ValueError:
+                value = None
+            if value is None:
+                raise ApiError(f"Некорректное значение параметра {param}.")
+            queryset = queryset.filter(**{lookup: value})
+    return queryset
+
+
+def get_page(resource: Resource, params, limit: int):
+    fields = select_fields(resource, params.get('fields'))
+    paths = {f: resource.fields[f][0] if isinstance(resource.fields[f], tuple) else resource.fields[f] for f in fields}
+
+    queryset = filter_queryset(resource, params)
+    if params.get('cursor'):
+        queryset = queryset.filter(id__gt=decode_cursor(params['cursor']))
+    rows = list(queryset.order_by('id').values_list(*paths.values())[:limit + 1])
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = []
+    for row in rows:
+        item = dict(zip(fields, row))
+        for field in fields:
+            if isinstance(resource.fields[field], tuple):
+                obj = references.get(resource.fields[field][1], item[field])
+                item[field] = obj.name if obj else None
+        results.append(item)
+    return results, encode_cursor(rows[-1][0]) if has_more else None
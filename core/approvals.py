@@ -0,0 +1,49 @@
+from collections import Counter
+
+from django.db import transaction
+
+from core.models import Transaction, TransactionStatus
+from core.portfolio import refresh_portfolios
+from core.references import references
+
+APPROVED = 'approved'
+REJECTED = 'rejected'
+ALREADY_PROCESSED = 'already_processed'
+NOT_FOUND = 'not_found'
+
+RESULT_LABELS = {
+    APPROVED: "Одобрена",
+    REJECTED: "Отклонена",
+    ALREADY_PROCESSED: "Уже обработана",
+    NOT_FOUND: "Не найдена",
+}
+
+
+def approve_transactions(transaction_ids, approve: bool, user):
+    transaction_ids = list(dict.fromkeys(int(i) for i in transaction_ids))
+    changes = {'approved': approve, 'approved_by': user}
+    if not approve:
+        changes['status'] = references.get_or_create(TransactionStatus, "Отменено")
+
+    with transaction.atomic():
+        pending = dict(Transaction.objects.select_for_update().filter(
+            id__in=transaction_ids, approved__isnull=True
+        ).values_list('id', 'product_id'))
+        if pending:
+            Transaction.objects.filter(id__in=pending, approved__isnull=True).update(**changes)
+            if not approve:
+                refresh_portfolios(set(pending.values()))
+        existing = set(Transaction.objects.filter(
+            id__in=[i for i in transaction_ids if i not in pending]
+        ).values_list('id', flat=True))
+
+    done = APPROVED if approve else REJECTED
+    return {
+        i: done if i in pending else ALREADY_PROCESSED if i in existing else NOT_FOUND
+        for i in transaction_ids
+    }
+
+
+def summarize_approval(results: dict):
+    counts = Counter(results.values())
+    return ", ".join(f"{RESULT_LABELS[result].lower()}: {count}" for result, count in counts.items())
@@ -0,0 +1,76 @@
+from datetime import date
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse, FileResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.core.exceptions import PermissionDenied
+from django.views.decorators.http import require_POST
+from django.contrib.auth.decorators import user_passes_test
+
+from core.api import ApiError
+from core.approvals import approve_transactions, ALREADY_PROCESSED, NOT_FOUND
+from core.models import Product, ReportJob
+from core.reports import generate_payment_schedule_pdf_async
+from core.utils import stream_payment_schedule_csv, check_permission
+from core.views import parse_approval_request, approval_response, report_job_response
+
+
+async def aiter_chunks(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+@user_passes_test(lambda u: u.is_staff)
+async def download_payment_schedule_report_async(request, product_id: int, _type: str):
+    _type = _type.lower().strip()
+    if _type not in ('csv', 'pdf'):
+        return HttpResponse("Некорректный формат файла.", status=400)
+
+    try:
+        product = await Product.objects.select_related('type', 'client__contact').aget(id=product_id)
+    except Product.DoesNotExist:
+        return HttpResponse("Продукт не найден.", status=404)
+
+    filename = f"ps_{product.id}_{date.today()}.{_type}"
+    if _type == 'csv':
+        # таблица графика строится запросами к базе, поэтому строки готовятся в потоке, а отдаются из цикла событий
+        chunks = await sync_to_async(lambda: list(stream_payment_schedule_csv(product)))()
+        response = StreamingHttpResponse(aiter_chunks(chunks), content_type="text/csv")
+    else:
+        path = await generate_payment_schedule_pdf_async(product)
+        response = FileResponse(open(path, 'rb'), content_type="application/pdf")
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@user_passes_test(lambda u: u.is_staff)
+async def download_report_job_async(request, job_id: int):
+    return report_job_response(await aget_object_or_404(ReportJob, id=job_id))
+
+
+@user_passes_test(lambda u: u.is_staff)
+async def approve_transaction_async(request, transaction_id, approve=True):
+    user = await request.auser()
+    if not await sync_to_async(check_permission)('approve_transaction', user):
+        raise PermissionDenied()
+
+    result = (await sync_to_async(approve_transactions)([transaction_id], approve, user))[transaction_id]
+    if result == NOT_FOUND:
+        raise Http404()
+    if result == ALREADY_PROCESSED:
+        return HttpResponse("Транзакция уже обработана.", status=400)
+    return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
+
+
+@require_POST
+@user_passes_test(lambda u: u.is_staff)
+async def approve_transactions_batch_async(request):
+    user = await request.auser()
+    if not await sync_to_async(check_permission)('approve_transaction', user):
+        return JsonResponse({"error": "Недостаточно прав."}, status=403)
+
+    try:
+        approve, ids = parse_approval_request(request)
+    except ApiError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return approval_response(await sync_to_async(approve_transactions)(ids, approve, user))
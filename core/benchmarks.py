@@ -0,0 +1,332 @@
+import io
+import os
+import csv
+import random
+import statistics
+import time
+from datetime import date, datetime, time as dt_time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+from django.db import transaction, connection, connections, DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.urls import reverse
+from django.contrib import admin
+from django.test import Client as TestClient
+from django.test.utils import CaptureQueriesContext
+from django.core.management.color import no_style
+from django.utils import timezone
+
+from core.models import (
+    Contact, Client, Product, ProductType, ProductStatus, PaymentSchedule, PaymentStatus,
+    Transaction, TransactionStatus, TransactionType, ReportJob, ProductPortfolio, ClientPortfolio
+)
+from core.approvals import approve_transactions
+from core.references import references
+from core.reports import render_payment_schedule_html, html_to_pdf
+from core.schedule import compute_schedule, add_months, get_schedule_mode
+from core.search import build_client_search_document
+from core.settings import WKHTMLTOPDF_PATH
+from core.utils import build_payment_schedule, stream_payment_schedule_csv
+
+BENCH_PREFIX = "bench "
+
+
+FIRST_NAMES = ["Иван", "Петр", "Алексей", "Сергей", "Анна", "Мария", "Елена", "Ольга", "Дмитрий", "Наталья"]
+LAST_NAMES = ["Иванов", "Петров", "Смирнов", "Кузнецов", "Попов", "Соколов", "Лебедев", "Козлов", "Новиков", "Морозов"]
+DURATIONS = [12, 24, 36, 60]
+
+
+class TableWriter:
+    def __init__(self, model, fields, batch_size: int, use_copy: bool):
+        self.model = model
+        self.fields = [model._meta.get_field(name) for name in fields]
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.rows = []
+        self.written = 0
+        self.next_id = (model.objects.aggregate(Max('id'))['id__max'] or 0) + 1
+
+    def allocate_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def add(self, row):
+        self.rows.append(row)
+
+    def flush(self):
+        if not self.rows:
+            return
+        db = connections[DEFAULT_DB_ALIAS]
+        table = db.ops.quote_name(self.model._meta.db_table)
+        columns = ", ".join(db.ops.quote_name(field.column) for field in self.fields)
+        with db.cursor() as cursor:
+            if self.use_copy:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for row in self.rows:
+                    writer.writerow(["\\N" if value is None else value for value in row])
+                buffer.seek(0)
+                cursor.cursor.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+            else:
+                cursor.executemany(
+                    f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(self.fields))})",
+                    [[field.get_db_prep_save(value, db) for field, value in zip(self.fields, row)] for row in self.rows]
+                )
+        self.written += len(self.rows)
+        self.rows = []
+
+    def reset_sequence(self):
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [self.model]):
+                cursor.execute(sql)
+
+
+@lru_cache(maxsize=32768)
+def installment_amounts(amount: int, interest_rate: int, duration: int, mode: str):
+    return [i.amount for i in compute_schedule(amount, interest_rate, duration, mode, date(2000, 1, 1))]
+
+
+def seed_schedule_data(clients: int, products_per_client: int = 3, durations=DURATIONS, batch_size: int = 50000,
+                       use_copy: bool = None, seed: int = 0, progress=None):
+    """Клиенты с контактами, продукты, графики платежей и транзакции с именами BENCH_PREFIX.
+    На PostgreSQL строки загружаются через COPY, возвращается количество записанных строк по таблицам"""
+    rng = random.Random(seed)
+    use_copy = connection.vendor == 'postgresql' if use_copy is None else use_copy
+    today = date.today()
+    product_types = references.all(ProductType)
+    product_status = references.by_name(ProductStatus, "Открыт") or references.all(ProductStatus)[0]
+    payment_statuses = {name: references.get_or_create(PaymentStatus, name) for name in ("Назначен", "Оплачен", "Просрочен")}
+    transaction_status = references.get_or_create(TransactionStatus, "Успешно")
+    transaction_types = {
+        'credit': references.get_or_create(TransactionType, "Пополнение"),
+        'deposit': references.get_or_create(TransactionType, "Выплата"),
+    }
+
+    writers = {
+        'contacts': TableWriter(Contact, ['id', 'name', 'phone', 'address', 'passport_series', 'passport_number'],
+                                batch_size, use_copy),
+        'clients': TableWriter(Client, ['id', 'contact', 'salary', 'birth_date', 'search_document'], batch_size, use_copy),
+        'products': TableWriter(Product, ['id', 'client', 'type', 'amount', 'interest_rate', 'duration', 'status',
+                                          'created_at'], batch_size, use_copy),
+        'transactions': TableWriter(Transaction, ['id', 'client', 'product', 'amount', 'type', 'date', 'approved',
+                                                  'status'], batch_size, use_copy),
+        'schedules': TableWriter(PaymentSchedule, ['id', 'product', 'client', 'contact', 'installment', 'amount',
+                                                   'scheduled_date', 'actual_date', 'status', 'transaction'],
+                                 batch_size, use_copy),
+    }
+    order = ['contacts', 'clients', 'products', 'transactions', 'schedules']
+
+    try:
+        for n in range(clients):
+            contact = Contact(
+                id=writers['contacts'].allocate_id(),
+                name=f"{BENCH_PREFIX}{rng.choice(LAST_NAMES)} {rng.choice(FIRST_NAMES)} {n}",
+                phone=f"+7{rng.randrange(10 ** 10):010d}", address=f"г. Москва, ул. Тестовая, д. {rng.randrange(1, 200)}",
+                passport_series=f"{rng.randrange(10 ** 4):04d}", passport_number=f"{rng.randrange(10 ** 6):06d}"
+            )
+            client = Client(
+                id=writers['clients'].allocate_id(), contact=contact,
+                salary=Decimal(rng.randrange(20, 300) * 1000), birth_date=today - timedelta(days=rng.randrange(18 * 365, 70 * 365))
+            )
+            writers['contacts'].add((contact.id, contact.name, contact.phone, contact.address,
+                                     contact.passport_series, contact.passport_number))
+            writers['clients'].add((client.id, contact.id, client.salary, client.birth_date,
+                                    build_client_search_document(client)))
+
+            for _ in range(rng.randint(1, 2 * products_per_client - 1)):
+                product_type = rng.choice(product_types)
+                amount, rate, duration = rng.randrange(1, 100) * 10000, rng.randrange(5, 30), rng.choice(durations)
+                start = today - timedelta(days=rng.randrange(0, 5 * 365))
+                product_id = writers['products'].allocate_id()
+                writers['products'].add((
+                    product_id, client.id, product_type.id, amount, rate, duration, product_status.id,
+                    timezone.make_aware(datetime.combine(start, dt_time(12)))
+                ))
+
+                mode = get_schedule_mode(product_type)
+                for month, payment in enumerate(installment_amounts(amount, rate, duration, mode), start=1):
+                    if not payment:
+                        continue
+                    scheduled_date = add_months(start, month)
+                    actual_date = transaction_id = None
+                    status = payment_statuses["Назначен"]
+                    if scheduled_date < today:
+                        if rng.random() < 0.9:
+                            actual_date = min(scheduled_date + timedelta(days=rng.randrange(-3, 5)), today)
+                            transaction_id = writers['transactions'].allocate_id()
+                            status = payment_statuses["Просрочен" if actual_date > scheduled_date else "Оплачен"]
+                            writers['transactions'].add((
+                                transaction_id, client.id, product_id, payment, transaction_types[product_type.behavior].id,
+                                timezone.make_aware(datetime.combine(actual_date, dt_time(12))),
+                                None if actual_date > today - timedelta(days=30) else True, transaction_status.id
+                            ))
+                        else:
+                            status = payment_statuses["Просрочен"]
+                    writers['schedules'].add((
+                        writers['schedules'].allocate_id(), product_id, client.id, contact.id, month, payment,
+                        scheduled_date, actual_date, status.id, transaction_id
+                    ))
+
+            if any(len(writers[name].rows) >= batch_size for name in order) or n == clients - 1:
+                with transaction.atomic():
+                    for name in order:
+                        writers[name].flush()
+                if progress:
+                    progress({name: writer.written for name, writer in writers.items()})
+    finally:
+        for writer in writers.values():
+            writer.reset_sequence()
+    return {name: writer.written for name, writer in writers.items()}
+
+
+def delete_where(queryset):
+    sql, params = queryset.values('pk').query.sql_with_params()
+    quote = connection.ops.quote_name
+    table, pk = quote(queryset.model._meta.db_table), quote(queryset.model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {table} WHERE {pk} IN (SELECT * FROM ({sql}) AS seeded)", params)
+        return cursor.rowcount
+
+
+def remove_seeded_data():
+    # каскадное удаление через ORM загружает все строки в память, поэтому таблицы чистятся по порядку ключей
+    contacts = Contact.objects.filter(name__startswith=BENCH_PREFIX)
+    clients = Client.objects.filter(contact__in=contacts)
+    products = Product.objects.filter(client__in=clients)
+    deleted = {}
+    with transaction.atomic():
+        for queryset in (
+            PaymentSchedule.objects.filter(client__in=clients),
+            Transaction.objects.filter(client__in=clients),
+            ReportJob.objects.filter(product__in=products),
+            ProductPortfolio.objects.filter(product__in=products),
+            ClientPortfolio.objects.filter(client__in=clients),
+            products, clients, contacts,
+        ):
+            deleted[queryset.model._meta.model_name] = delete_where(queryset)
+    return deleted
+
+
+def admin_filter_queries():
+    today = date.today()
+    month_start = today.replace(day=1)
+    payment_status = PaymentStatus.objects.first()
+    transaction_status = TransactionStatus.objects.first()
+    transaction_type = TransactionType.objects.first()
+    product = Product.objects.order_by('-id').first()
+    schedules = PaymentSchedule.objects.select_related('product__type', 'status')
+    transactions = Transaction.objects.select_related('product__type', 'type', 'status')
+    return {
+        "paymentschedule status": schedules.filter(status=payment_status),
+        "paymentschedule scheduled_date (month)": schedules.filter(
+            scheduled_date__gte=month_start, scheduled_date__lt=month_start + timedelta(days=31)
+        ),
+        "paymentschedule actual_date (7 days)": schedules.filter(actual_date__gte=today - timedelta(days=7)),
+        "paymentschedule product": schedules.filter(product=product),
+        "paymentschedule unpaid due": schedules.filter(scheduled_date__lt=today, transaction__isnull=True),
+        "transaction type": transactions.filter(type=transaction_type),
+        "transaction status": transactions.filter(status=transaction_status),
+        "transaction date (today)": transactions.filter(date__gte=timezone.now() - timedelta(days=1)),
+        "transaction approved pending": transactions.filter(approved__isnull=True),
+        "transaction product": transactions.filter(product=product),
+    }
+
+
+def time_query(queryset, page_size: int = 100, repeat: int = 3):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        queryset.count()
+        list(queryset.order_by('-pk')[:page_size])
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def table_rows(model):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            return max(cursor.fetchone()[0], 0)
+    return model.objects.count()
+
+
+def rolled_back(func):
+    def run():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+    return run
+
+
+def measure(func, repeat: int = 3):
+    timings = []
+    queries = 0
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        queries = len(captured)
+    return {
+        "min": min(timings), "median": statistics.median(timings), "max": max(timings), "queries": queries,
+    }
+
+
+def build_benchmarks(user, client, sample_size: int = 100):
+    benchmarks = {}
+    product = Product.objects.select_related('type', 'client__contact').order_by('-id').first()
+    if product is not None:
+        benchmarks["gen_payment_schedule (создание продукта)"] = rolled_back(lambda: Product(
+            client_id=product.client_id, type=product.type, amount=product.amount, interest_rate=product.interest_rate,
+            duration=60, status_id=product.status_id
+        ).save())
+        sample = list(Product.objects.select_related('type').order_by('-id')[:sample_size])
+        status = references.get_or_create(PaymentStatus, "Назначен")
+        benchmarks[f"build_payment_schedule x{len(sample)}"] = lambda: [build_payment_schedule(p, status) for p in sample]
+        benchmarks["отчет HTML"] = lambda: render_payment_schedule_html(product)
+        benchmarks["отчет CSV"] = lambda: "".join(stream_payment_schedule_csv(product))
+        if os.path.exists(WKHTMLTOPDF_PATH):
+            html = render_payment_schedule_html(product)
+            benchmarks["отчет PDF"] = lambda: html_to_pdf(html)
+
+    pending = list(Transaction.objects.filter(approved__isnull=True).order_by('id').values_list('id', flat=True)[:sample_size])
+    if pending:
+        benchmarks[f"одобрение x{len(pending)}"] = rolled_back(lambda: approve_transactions(pending, True, user))
+
+    contact_name = Contact.objects.filter(name__startswith=BENCH_PREFIX).values_list('name', flat=True).first()
+    search_term = contact_name.split()[1] if contact_name else "иван"
+    for model, model_admin in admin.site._registry.items():
+        if model._meta.app_label != 'core':
+            continue
+        url = reverse(f'admin:core_{model._meta.model_name}_changelist')
+        benchmarks[f"админка {model._meta.model_name}"] = lambda url=url: client.get(url)
+        if model_admin.search_fields:
+            benchmarks[f"админка {model._meta.model_name} поиск"] = lambda url=url: client.get(url, {'q': search_term})
+    for resource in ('clients', 'products', 'schedules', 'transactions'):
+        url = reverse('api_list', args=[resource])
+        benchmarks[f"api {resource}"] = lambda url=url: client.get(url, {'limit': 500})
+    return benchmarks
+
+
+def run_benchmarks(user, repeat: int = 3, sample_size: int = 100, only=None, progress=None):
+    results = {}
+    # вход создает сессию в рабочей базе, выход после замеров ее удаляет
+    client = TestClient(SERVER_NAME='localhost')
+    client.force_login(user)
+    try:
+        for name, func in build_benchmarks(user, client, sample_size).items():
+            if only and not any(part in name for part in only):
+                continue
+            results[name] = measure(func, repeat)
+            if progress:
+                progress(name, results[name])
+    finally:
+        client.logout()
+    return {
+        "created_at": timezone.now().isoformat(),
+        "database": connection.vendor,
+        "repeat": repeat,
+        "rows": {model._meta.model_name: table_rows(model) for model in (Client, Product, PaymentSchedule, Transaction)},
+        "benchmarks": results,
+    }
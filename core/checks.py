@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# кэши, которые видны только одному процессу: сброс версии прав и справочников не дойдет до остальных воркеров
+PROCESS_LOCAL_CACHES = ['django.core.cache.backends.locmem.LocMemCache']
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    if settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES:
+        return [Error(
+            "Кэш по умолчанию не общий для процессов.",
+            hint="Кэши прав и справочников сбрасываются через кэш, настройте в CACHES Redis, Memcached или DatabaseCache.",
+            id='core.E001',
+        )]
+    return []
@@ -0,0 +1,135 @@
+import csv
+import json
+from datetime import datetime, time
+from decimal import Decimal, InvalidOperation
+from collections import defaultdict, deque
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import Product, PaymentSchedule, PaymentStatus, Transaction, TransactionStatus, TransactionType
+from core.portfolio import refresh_portfolios
+from core.references import references
+from core.schedule import CENT
+from core.utils import bulk_update_values, get_payment_schedules, is_lazy_schedule
+
+
+def read_statement(path: str):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif path.endswith(".json"):
+            yield from json.load(f)
+        else:
+            dialect = csv.Sniffer().sniff(f.read(4096), delimiters=",;\t")
+            f.seek(0)
+            yield from csv.DictReader(f, dialect=dialect)
+
+
+def parse_statement_date(value):
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = parse_datetime(str(value)) or datetime.combine(parse_date(str(value)), time())
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def parse_statement_row(row: dict):
+    try:
+        return {
+            "product_id": int(row["product"]),
+            "amount": Decimal(str(row["amount"]).replace(",", ".")).quantize(CENT),
+            "date": parse_statement_date(row["date"]),
+            "type": (row.get("type") or "Пополнение").strip(),
+        }
+    except (KeyError, ValueError, TypeError, InvalidOperation):
+        return None
+
+
+class StatementImporter:
+    def __init__(self, chunk_size: int = 5000):
+        self.chunk_size = chunk_size
+        self.statuses = {
+            name: references.get_or_create(PaymentStatus, name) for name in ("Оплачен", "Просрочен")
+        }
+        self.transaction_status = references.get_or_create(TransactionStatus, "Успешно")
+        self.stats = {"rows": 0, "created": 0, "matched": 0, "unmatched": 0, "rejected": 0}
+        self.rejected = []
+
+    def run(self, rows):
+        rows = iter(rows)
+        while chunk := list(islice(rows, self.chunk_size)):
+            self.import_chunk(chunk)
+        return self.stats
+
+    def import_chunk(self, chunk):
+        self.stats["rows"] += len(chunk)
+        lines = []
+        for row in chunk:
+            line = parse_statement_row(row)
+            if line is None:
+                self.reject(row, "Некорректная строка")
+            else:
+                lines.append(line)
+
+        product_ids = {line["product_id"] for line in lines}
+        products = list(Product.objects.filter(id__in=product_ids).select_related('type', 'client'))
+        clients = {product.id: product.client_id for product in products}
+        lazy_products = [product for product in products if is_lazy_schedule(product)]
+        open_payments = defaultdict(deque)
+        for payment in PaymentSchedule.objects.filter(
+            product_id__in=clients, transaction__isnull=True
+        ).exclude(product__in=lazy_products).order_by('scheduled_date', 'id').only(
+            'id', 'product_id', 'amount', 'scheduled_date'
+        ):
+            open_payments[(payment.product_id, payment.amount)].append(payment)
+        for payments in get_payment_schedules(lazy_products).values():
+            for payment in payments:
+                if payment.transaction_id is None:
+                    open_payments[(payment.product_id, payment.amount)].append(payment)
+
+        transactions, matches = [], []
+        for line in sorted(lines, key=lambda l: l["date"]):
+            if line["product_id"] not in clients:
+                self.reject(line, "Продукт не найден")
+                continue
+            obj = Transaction(
+                client_id=clients[line["product_id"]], product_id=line["product_id"], amount=line["amount"],
+                type=references.by_name(TransactionType, line["type"]), status=self.transaction_status, date=line["date"]
+            )
+            transactions.append(obj)
+            candidates = open_payments.get((line["product_id"], line["amount"]))
+            if candidates:
+                matches.append((candidates.popleft(), obj))
+
+        with transaction.atomic():
+            dates = [obj.date for obj in transactions]
+            created = Transaction.objects.bulk_create(transactions, batch_size=1000)
+            for obj, statement_date in zip(created, dates):
+                obj.date = statement_date
+            # date заполняется auto_now_add, поэтому дата из выписки проставляется отдельным UPDATE
+            bulk_update_values(Transaction, ['date'], [(obj.id, obj.date) for obj in created])
+
+            for payment, obj in matches:
+                payment.transaction = obj
+                payment.actual_date = obj.date.date()
+                payment.status = self.statuses["Просрочен" if obj.date.date() > payment.scheduled_date else "Оплачен"]
+            saved = [payment for payment, _ in matches if payment.pk is not None]
+            # рассчитанные платежи графиков по требованию сохраняются только при сопоставлении с транзакцией
+            PaymentSchedule.objects.bulk_create([payment for payment, _ in matches if payment.pk is None], batch_size=1000)
+            bulk_update_values(PaymentSchedule, ['transaction', 'actual_date', 'status'], [
+                (payment.id, payment.transaction_id, payment.actual_date, payment.status_id) for payment in saved
+            ])
+            refresh_portfolios({obj.product_id for obj in created})
+
+        self.stats["created"] += len(created)
+        self.stats["matched"] += len(matches)
+        self.stats["unmatched"] += len(created) - len(matches)
+
+    def reject(self, row, reason):
+        self.stats["rejected"] += 1
+        self.rejected.append((row, reason))
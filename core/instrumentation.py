@@ -0,0 +1,175 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter, defaultdict, deque
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from core.settings import INSTRUMENTATION_ENABLED, INSTRUMENTATION_SAMPLES, INSTRUMENTATION_DUPLICATE_THRESHOLD
+
+HISTOGRAM_BUCKETS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, None]
+
+current_metrics = ContextVar('current_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.statements = Counter()
+        self.spans = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add_query(self, sql: str, params, elapsed: float):
+        with self._lock:
+            self.queries += 1
+            self.sql_time += elapsed
+            self.statements[(sql, repr(params))] += 1
+
+    def add_span(self, name: str, elapsed: float):
+        with self._lock:
+            self.spans[name] += elapsed
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count > 1)
+
+    @property
+    def similar(self):
+        by_sql = Counter()
+        for (sql, _), count in self.statements.items():
+            by_sql[sql] += count
+        return sum(count for count in by_sql.values() if count >= INSTRUMENTATION_DUPLICATE_THRESHOLD)
+
+    def server_timing(self, total: float):
+        entries = [
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f'dup;desc="{self.duplicates} duplicate, {self.similar} similar"',
+        ]
+        entries += [f'{name};dur={elapsed * 1000:.1f}' for name, elapsed in sorted(self.spans.items())]
+        entries.append(f'total;dur={total * 1000:.1f}')
+        return ", ".join(entries)
+
+
+@contextmanager
+def timed(name: str):
+    metrics = current_metrics.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add_span(name, time.perf_counter() - started)
+
+
+def record_query(execute, sql, params, many, context):
+    metrics = current_metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.add_query(sql, params, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class ViewStats:
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.requests = 0
+
+    def add(self, total: float, metrics: RequestMetrics):
+        self.requests += 1
+        self.samples.append((total, metrics.sql_time, metrics.queries, metrics.duplicates, dict(metrics.spans)))
+
+    def summary(self):
+        totals = sorted(sample[0] for sample in self.samples)
+        histogram = []
+        lower = 0
+        for upper in HISTOGRAM_BUCKETS:
+            count = sum(1 for t in totals if lower <= t * 1000 < (upper or float('inf')))
+            share = count * 100 // len(totals) if totals else 0
+            histogram.append((f"{lower}–{upper} мс" if upper else f"≥ {lower} мс", count, share))
+            lower = upper
+        count = len(self.samples) or 1
+        return {
+            "requests": self.requests,
+            "samples": len(self.samples),
+            "p50": totals[len(totals) // 2] * 1000 if totals else 0,
+            "p95": totals[min(len(totals) - 1, int(len(totals) * 0.95))] * 1000 if totals else 0,
+            "avg_sql": sum(sample[1] for sample in self.samples) / count * 1000,
+            "avg_queries": sum(sample[2] for sample in self.samples) / count,
+            "max_duplicates": max((sample[3] for sample in self.samples), default=0),
+            "spans": {
+                name: sum(sample[4].get(name, 0) for sample in self.samples) / count * 1000
+                for name in sorted({name for sample in self.samples for name in sample[4]})
+            },
+            "histogram": histogram,
+        }
+
+
+class Registry:
+    def __init__(self, size: int):
+        self.size = size
+        self.views = {}
+        self._lock = threading.Lock()
+
+    def add(self, view: str, total: float, metrics: RequestMetrics):
+        with self._lock:
+            self.views.setdefault(view, ViewStats(self.size)).add(total, metrics)
+
+    def summary(self):
+        with self._lock:
+            return sorted(
+                ((view, stats.summary()) for view, stats in self.views.items()),
+                key=lambda item: item[1]['p95'], reverse=True
+            )
+
+    def clear(self):
+        with self._lock:
+            self.views = {}
+
+
+registry = Registry(INSTRUMENTATION_SAMPLES)
+
+
+class InstrumentationMiddleware:
+    def __init__(self, get_response):
+        if not INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed()
+        connection_created.connect(install_query_recorder, dispatch_uid='core.instrumentation')
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(None, connection)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_metrics.reset(token)
+
+        total = time.perf_counter() - metrics.started
+        response['Server-Timing'] = metrics.server_timing(total)
+        match = request.resolver_match
+        registry.add(match.view_name if match else request.path, total, metrics)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = current_metrics.get()
+        if metrics is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda r: metrics.add_span('template', time.perf_counter() - started))
+        return response
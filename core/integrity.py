@@ -0,0 +1,92 @@
+from typing import NamedTuple
+
+from django.db import connection as default_connection, transaction
+
+
+class Check(NamedTuple):
+    name: str
+    description: str
+    table: str
+    query: str
+    fix: str = None
+
+
+# запросы выбирают идентификаторы строк-нарушителей, исправления — UPDATE по тем же условиям для диапазона id
+CHECKS = [
+    Check(
+        'transaction_client', "Клиент транзакции не совпадает с владельцем продукта", 'core_transaction',
+        "SELECT t.id FROM core_transaction t JOIN core_product p ON p.id = t.product_id WHERE t.client_id <> p.client_id",
+        "UPDATE core_transaction AS t SET client_id = p.client_id FROM core_product p "
+        "WHERE p.id = t.product_id AND t.client_id <> p.client_id",
+    ),
+    Check(
+        'schedule_client', "Клиент платежа не совпадает с владельцем продукта", 'core_paymentschedule',
+        "SELECT t.id FROM core_paymentschedule t JOIN core_product p ON p.id = t.product_id "
+        "WHERE t.client_id IS NULL OR t.client_id <> p.client_id",
+        "UPDATE core_paymentschedule AS t SET client_id = p.client_id FROM core_product p "
+        "WHERE p.id = t.product_id AND (t.client_id IS NULL OR t.client_id <> p.client_id)",
+    ),
+    Check(
+        'schedule_contact', "Контакт платежа не совпадает с контактом клиента", 'core_paymentschedule',
+        "SELECT t.id FROM core_paymentschedule t JOIN core_client c ON c.id = t.client_id "
+        "WHERE t.contact_id <> c.contact_id OR (t.contact_id IS NULL) <> (c.contact_id IS NULL)",
+        "UPDATE core_paymentschedule AS t SET contact_id = c.contact_id FROM core_client c "
+        "WHERE c.id = t.client_id AND (t.contact_id <> c.contact_id OR (t.contact_id IS NULL) <> (c.contact_id IS NULL))",
+    ),
+    Check(
+        'schedule_transaction', "Платеж связан с отсутствующей транзакцией или транзакцией другого продукта",
+        'core_paymentschedule',
+        "SELECT t.id FROM core_paymentschedule t LEFT JOIN core_transaction x ON x.id = t.transaction_id "
+        "WHERE t.transaction_id IS NOT NULL AND (x.id IS NULL OR x.product_id <> t.product_id)",
+    ),
+    Check(
+        'schedule_transaction_duplicate', "Одна транзакция связана с несколькими платежами", 'core_paymentschedule',
+        "SELECT t.id FROM core_paymentschedule t WHERE t.transaction_id IN ("
+        "SELECT transaction_id FROM core_paymentschedule WHERE transaction_id IS NOT NULL "
+        "GROUP BY transaction_id HAVING count(*) > 1)",
+    ),
+]
+
+# на PostgreSQL согласованность поддерживают составные внешние ключи (миграция 0016): ON UPDATE CASCADE переносит
+# смену владельца продукта и контакта клиента в зависимые строки, а контакт платежа при смене клиента подставляет
+# триггер core_paymentschedule_sync_contact (миграция 0019); проверки нужны для SQLite и данных до миграций
+
+
+def count_violations(check: Check, sample: int = 0, connection=None):
+    connection = connection or default_connection
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT count(*) FROM ({check.query}) q")
+        count = cursor.fetchone()[0]
+        ids = []
+        if count and sample:
+            cursor.execute(f"{check.query} ORDER BY t.id LIMIT %s", [sample])
+            ids = [row[0] for row in cursor.fetchall()]
+    return count, ids
+
+
+def fix_violations(check: Check, batch_size: int = 50000, connection=None):
+    connection = connection or default_connection
+    fixed = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT min(id), max(id) FROM {check.table}")
+        low, high = cursor.fetchone()
+        if low is None:
+            return 0
+        for start in range(low - 1, high, batch_size):
+            with transaction.atomic(using=connection.alias):
+                cursor.execute(f"{check.fix} AND t.id > %s AND t.id <= %s", [start, start + batch_size])
+                fixed += cursor.rowcount
+    return fixed
+
+
+def verify_integrity(fix: bool = False, sample: int = 0, batch_size: int = 50000, connection=None):
+    results = []
+    for check in CHECKS:
+        count, ids = count_violations(check, sample, connection)
+        fixed = 0
+        if count and fix and check.fix:
+            fixed = fix_violations(check, batch_size, connection)
+            count, ids = count_violations(check, sample, connection)
+        results.append((check, count, fixed, ids))
+    return results
+
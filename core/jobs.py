@@ -0,0 +1,84 @@
+from pathlib import Path
+from datetime import timedelta
+
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+
+from core.models import Product, ReportJob
+from core.reports import generate_payment_schedule_pdf, write_reports_archive
+from core.settings import REPORT_CACHE_DIR
+from core.utils import stream_payment_schedule_csv
+
+
+def enqueue_report(product: Product, report_type: str, user=None):
+    job = ReportJob.objects.filter(
+        product=product, report_type=report_type, status__in=[ReportJob.QUEUED, ReportJob.RUNNING]
+    ).first()
+    return job or ReportJob.objects.create(product=product, report_type=report_type, requested_by=user)
+
+
+def enqueue_reports_archive(products, report_type: str, user=None):
+    with transaction.atomic():
+        job = ReportJob.objects.create(report_type=report_type, requested_by=user)
+        job.products.set(products)
+    return job
+
+
+def claim_report_job(max_running: int = None):
+    with transaction.atomic():
+        if max_running and ReportJob.objects.filter(status=ReportJob.RUNNING).count() >= max_running:
+            return None
+        job = ReportJob.objects.select_for_update(skip_locked=True).filter(
+            status=ReportJob.QUEUED
+        ).order_by('id').first()
+        if job is None:
+            return None
+        job.status = ReportJob.RUNNING
+        job.started_at = timezone.now()
+        job.save(update_fields=['status', 'started_at'])
+        return job
+
+
+def reset_stale_report_jobs(timeout: int):
+    return ReportJob.objects.filter(
+        status=ReportJob.RUNNING, started_at__lt=timezone.now() - timedelta(seconds=timeout)
+    ).update(status=ReportJob.QUEUED, started_at=None)
+
+
+def write_payment_schedule_csv(product: Product, job: ReportJob):
+    path = Path(REPORT_CACHE_DIR) / f"job_{job.id}_ps_{product.id}.csv"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(stream_payment_schedule_csv(product))
+    return path
+
+
+def write_reports_archive_file(job: ReportJob):
+    path = Path(REPORT_CACHE_DIR) / f"job_{job.id}_reports_{job.report_type}.zip"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        write_reports_archive(job.products.all(), job.report_type, f)
+    return path
+
+
+def run_product_report(job: ReportJob):
+    product = Product.objects.select_related('type', 'client__contact').get(id=job.product_id)
+    if job.report_type == 'pdf':
+        return generate_payment_schedule_pdf(product)
+    return write_payment_schedule_csv(product, job)
+
+
+def run_report_job(job: ReportJob):
+    close_old_connections()
+    try:
+        if job.is_archive:
+            path = write_reports_archive_file(job)
+        else:
+            path = run_product_report(job)
+        job.status, job.file, job.error = ReportJob.DONE, str(path), ""
+    except Exception as e:
+        job.status, job.error = ReportJob.FAILED, repr(e)
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'file', 'error', 'finished_at'])
+    close_old_connections()
+    return job
@@ -0,0 +1,48 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.partitioning import PARTITIONED_TABLES, is_partitioned, archivable_partitions, archive_partition
+from core.settings import ARCHIVE_DIR, ARCHIVE_PRODUCT_STATUSES
+
+
+class Command(BaseCommand):
+    help = (
+        "Архивирует завершенные партиции графиков платежей и транзакций: выгружает их в сжатый CSV, "
+        "отсоединяет и удаляет. В архив попадают только прошедшие периоды, все строки которых относятся "
+        "к продуктам в завершающих статусах, а транзакции — только вместе со ссылающимися на них платежами"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', default=ARCHIVE_DIR)
+        parser.add_argument('--status', action='append', help="Завершающий статус продукта (можно указать несколько)")
+        parser.add_argument('--keep', action='store_true', help="Отсоединить партиции без удаления таблиц")
+        parser.add_argument('--dry-run', action='store_true', help="Только вывести партиции, подходящие для архивации")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Секционирование поддерживается только на PostgreSQL")
+
+        statuses = options['status'] or ARCHIVE_PRODUCT_STATUSES
+        archived, selected = 0, []
+        for spec in PARTITIONED_TABLES:
+            with connection.cursor() as cursor:
+                if not is_partitioned(cursor, spec.table):
+                    self.stdout.write(f"{spec.table}: не секционирована, пропуск")
+                    continue
+                # транзакции проверяются после графиков: архивируются только партиции, платежи по которым
+                # уходят в архив в этом же запуске
+                partitions = archivable_partitions(cursor, spec, statuses, archived=selected)
+                selected.extend(p.name for p in partitions)
+
+            for partition in partitions:
+                if options['dry_run']:
+                    self.stdout.write(f"{partition.name}: {partition.start} — {partition.end}, ~{partition.rows} строк")
+                    continue
+                path = archive_partition(spec, partition, Path(options['directory']), drop=not options['keep'])
+                archived += 1
+                self.stdout.write(f"{partition.name} выгружена в {path}")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f"Архивировано партиций: {archived}"))
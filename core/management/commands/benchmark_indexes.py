@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import seed_schedule_data, remove_seeded_data, admin_filter_queries, time_query
+
+
+class Command(BaseCommand):
+    help = "Замеряет планы и время запросов для фильтров админки графиков платежей и транзакций"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help="Добавить указанное количество клиентов перед замером")
+        parser.add_argument('--cleanup', action='store_true', help="Удалить тестовые данные после замера")
+        parser.add_argument('--explain', action='store_true', help="Вывести планы запросов")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            written = seed_schedule_data(options['seed'])
+            self.stdout.write(f"Добавлено продуктов: {written['products']}, платежей: {written['schedules']}")
+
+        for name, queryset in admin_filter_queries().items():
+            elapsed = time_query(queryset, repeat=options['repeat'])
+            self.stdout.write(f"{elapsed * 1000:10.2f} мс  {name}")
+            if options['explain']:
+                self.stdout.write(queryset.order_by('-pk')[:100].explain())
+                self.stdout.write("")
+
+        if options['cleanup']:
+            remove_seeded_data()
+            self.stdout.write("Тестовые данные удалены")
@@ -0,0 +1,41 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Product
+from core.reports import write_reports_archive
+from core.settings import PDF_WORKERS
+
+
+class Command(BaseCommand):
+    help = "Формирует ZIP-архив с графиками платежей по нескольким продуктам"
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true', help="Все продукты")
+        parser.add_argument('--status', help="Название статуса продукта")
+        parser.add_argument('--product-type', help="Название типа продукта")
+        parser.add_argument('--client', type=int, action='append', help="ID клиента, можно указать несколько раз")
+        parser.add_argument('--format', choices=['pdf', 'csv'], default='pdf')
+        parser.add_argument('--workers', type=int, default=PDF_WORKERS)
+        parser.add_argument('-o', '--output')
+
+    def handle(self, *args, **options):
+        filters = [options[key] for key in ('product_ids', 'status', 'product_type', 'client')]
+        if not any(filters) and not options['all']:
+            raise CommandError("Укажите ID продуктов, фильтры или --all")
+
+        products = Product.objects.all()
+        if options['product_ids']:
+            products = products.filter(id__in=options['product_ids'])
+        if options['status']:
+            products = products.filter(status__name=options['status'])
+        if options['product_type']:
+            products = products.filter(type__name=options['product_type'])
+        if options['client']:
+            products = products.filter(client_id__in=options['client'])
+
+        output = options['output'] or f"reports_{options['format']}_{date.today()}.zip"
+        with open(output, "wb") as f:
+            count = write_reports_archive(products, options['format'], f, options['workers'])
+        self.stdout.write(self.style.SUCCESS(f"Отчетов сформировано: {count} -> {output}"))
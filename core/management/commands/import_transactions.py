@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.imports import StatementImporter, read_statement
+
+
+class Command(BaseCommand):
+    help = "Импортирует транзакции из банковской выписки (CSV, JSON, JSONL) и сопоставляет их с графиками платежей"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл выписки с колонками product, amount, date и необязательной type")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        importer = StatementImporter(options['chunk_size'])
+        stats = importer.run(read_statement(options['path']))
+        elapsed = time.perf_counter() - started
+
+        for row, reason in importer.rejected[:20]:
+            self.stderr.write(f"{reason}: {row}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Строк: {stats['rows']}, создано транзакций: {stats['created']}, сопоставлено с графиком: {stats['matched']}, "
+            f"без платежа в графике: {stats['unmatched']}, отклонено: {stats['rejected']} "
+            f"за {elapsed:.2f} с ({stats['rows'] / elapsed * 60 if elapsed else 0:.0f} строк/мин)"
+        ))
@@ -0,0 +1,142 @@
+import time
+import threading
+from importlib import import_module
+from collections import Counter
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Manager, Product
+from core.reports import generate_payment_schedule_pdf, clear_cached_pdfs
+from core.settings import PDF_RENDER_TIMEOUT, REPORT_POLL_INTERVAL
+
+
+def percentile(values, q: float):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def create_session(user):
+    session = import_module(settings.SESSION_ENGINE).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session
+
+
+def download(session, url: str, timeout: float):
+    # при промахе кэша синхронный сервер перенаправляет на задачу, поэтому время считается до получения файла
+    deadline = time.perf_counter() + timeout
+    response = session.get(url, timeout=timeout, allow_redirects=False)
+    while response.status_code in (202, 302):
+        if time.perf_counter() > deadline:
+            return 'timeout'
+        if response.status_code == 302:
+            url = urljoin(url, response.headers['Location'])
+        else:
+            time.sleep(float(response.headers.get('Refresh', REPORT_POLL_INTERVAL)))
+        response = session.get(url, timeout=timeout, allow_redirects=False)
+    return response.status_code
+
+
+def run_load(url_template: str, product_ids, total: int, concurrency: int, cookies: dict, timeout: float):
+    local = threading.local()
+
+    def fetch(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.cookies.update(cookies)
+        url = url_template.format(product=product_ids[i % len(product_ids)])
+        started = time.perf_counter()
+        try:
+            status = download(local.session, url, timeout)
+        except requests.RequestException:
+            status = 'error'
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(fetch, range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": total,
+        "statuses": Counter(status for _, status in results),
+        "rps": total / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": latencies[-1] if latencies else 0.0,
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест выгрузки отчетов: сравнивает пропускную способность и задержки серверов. "
+        "Пример: load_test_reports wsgi=http://127.0.0.1:8000/api/report/pdf/{product} "
+        "asgi=http://127.0.0.1:8001/api/async/report/pdf/{product}. "
+        "Для каждой цели замеряются холодный запуск (кэш PDF очищен, каждый продукт запрашивается один раз) "
+        "и прогретый. Для синхронного сервера холодный запуск требует работающего run_report_worker"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help="Цели вида имя=URL, {product} заменяется на ID продукта")
+        parser.add_argument('--requests', type=int, default=200, help="Запросов на цель")
+        parser.add_argument('--concurrency', type=int, default=20, help="Одновременных запросов")
+        parser.add_argument('--products', type=int, default=20, help="Сколько продуктов запрашивать по кругу")
+        parser.add_argument('--warmup', type=int, default=0, help="Запросов на прогрев перед замером")
+        parser.add_argument('--username', help="Пользователь, от имени которого выполняются запросы")
+        parser.add_argument('--timeout', type=float, default=PDF_RENDER_TIMEOUT)
+
+    def handle(self, *args, **options):
+        targets = []
+        for target in options['targets']:
+            name, sep, url = target.partition('=')
+            if not sep or not url.startswith('http'):
+                raise CommandError(f"Некорректная цель: {target}")
+            targets.append((name, url))
+
+        product_ids = list(Product.objects.order_by('id').values_list('id', flat=True)[:options['products']])
+        if not product_ids:
+            raise CommandError("Нет продуктов для выгрузки")
+        products = Product.objects.filter(id__in=product_ids).select_related('type', 'client__contact')
+
+        users = Manager.objects.filter(is_active=True, is_staff=True)
+        user = users.filter(username=options['username']).first() if options['username'] \
+            else users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError("Не найден активный сотрудник для авторизации")
+
+        session = create_session(user)
+        cookies = {settings.SESSION_COOKIE_NAME: session.session_key}
+        try:
+            for name, url in targets:
+                # холодный запуск: синхронный сервер формирует PDF в задаче, асинхронный — в запросе
+                clear_cached_pdfs(product_ids)
+                self.write_stats(f"{name} холодный", run_load(
+                    url, product_ids, len(product_ids), options['concurrency'], cookies, options['timeout']
+                ))
+
+                # прогретый: оба сервера отдают один и тот же готовый файл
+                for product in products:
+                    generate_payment_schedule_pdf(product)
+                if options['warmup']:
+                    run_load(url, product_ids, options['warmup'], options['concurrency'], cookies, options['timeout'])
+                self.write_stats(f"{name} прогретый", run_load(
+                    url, product_ids, options['requests'], options['concurrency'], cookies, options['timeout']
+                ))
+        finally:
+            session.delete()
+
+    def write_stats(self, name: str, stats: dict):
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(stats['statuses'].items(), key=str))
+        self.stdout.write(
+            f"{name:<20} {stats['rps']:8.1f} запр/с  p50 {stats['p50'] * 1000:8.1f} мс  "
+            f"p95 {stats['p95'] * 1000:8.1f} мс  p99 {stats['p99'] * 1000:8.1f} мс  "
+            f"max {stats['max'] * 1000:8.1f} мс  [{statuses}]"
+        )
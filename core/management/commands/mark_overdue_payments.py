@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from core.utils import mark_overdue_payments
+
+
+class Command(BaseCommand):
+    help = "Переводит неоплаченные платежи с прошедшей датой в статус «Просрочен»"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, help="Дата, на которую проверяются платежи (по умолчанию сегодня)")
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        stats = mark_overdue_payments(options['date'], options['chunk_size'])
+        rate = stats['updated'] / stats['seconds'] if stats['seconds'] else 0
+        self.stdout.write(self.style.SUCCESS(
+            f"Просрочено платежей: {stats['updated']} ({stats['products']} продуктов, {stats['chunks']} пакетов) "
+            f"за {stats['seconds']:.2f} с, {rate:.0f} строк/с"
+        ))
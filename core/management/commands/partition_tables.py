@@ -0,0 +1,44 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core.partitioning import (
+    PARTITIONED_TABLES, partition_tables, ensure_partitions, list_partitions, is_partitioned
+)
+from core.schedule import add_months
+from core.settings import PARTITION_AHEAD
+
+
+class Command(BaseCommand):
+    help = (
+        "Секционирование графиков платежей (по годам) и транзакций (по месяцам): переводит таблицы на "
+        "секционирование без остановки записи и создает партиции на будущие периоды. Запускать по расписанию"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=PARTITION_AHEAD, help="На сколько месяцев вперед создавать партиции")
+        parser.add_argument('--batch-size', type=int, default=50000, help="Строк в одной транзакции при переносе")
+        parser.add_argument('--list', action='store_true', help="Только вывести существующие партиции")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Секционирование поддерживается только на PostgreSQL")
+
+        if not options['list']:
+            converted = partition_tables(options['batch_size'], options['ahead'], progress=self.stdout.write)
+            for spec in PARTITIONED_TABLES:
+                for name in ensure_partitions(spec, add_months(date.today(), options['ahead'])):
+                    self.stdout.write(f"Создана партиция {name}")
+            if converted:
+                self.stdout.write(self.style.SUCCESS(f"Переведены на секционирование: {', '.join(converted)}"))
+
+        with connection.cursor() as cursor:
+            for spec in PARTITIONED_TABLES:
+                if not is_partitioned(cursor, spec.table):
+                    self.stdout.write(f"{spec.table}: не секционирована")
+                    continue
+                self.stdout.write(f"{spec.table}:")
+                for partition in list_partitions(cursor, spec.table):
+                    bounds = f"{partition.start} — {partition.end}" if partition.start else "по умолчанию"
+                    self.stdout.write(f"  {partition.name:<36} {bounds:<26} ~{partition.rows} строк")
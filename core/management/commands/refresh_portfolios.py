@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.models import Product
+from core.portfolio import refresh_portfolios
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает показатели продуктов и клиентов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        product_ids = options['product_ids'] or Product.objects.order_by('id').values_list('id', flat=True)
+        batch_size = options['batch_size']
+        count = 0
+        batch = []
+        for product_id in product_ids:
+            batch.append(product_id)
+            if len(batch) >= batch_size:
+                refresh_portfolios(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            refresh_portfolios(batch)
+            count += len(batch)
+        self.stdout.write(self.style.SUCCESS(f"Показатели пересчитаны для продуктов: {count}"))
@@ -0,0 +1,50 @@
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Product, PaymentSchedule
+from core.utils import gen_payment_schedules
+
+
+class Command(BaseCommand):
+    help = (
+        "Пересоздает графики платежей для продуктов без проведенных платежей. У продуктов с графиком "
+        "по требованию сохраненные платежи удаляются, график рассчитывается при просмотре"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_ids', nargs='*', type=int)
+        parser.add_argument('--all', action='store_true', help="Обработать все продукты")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not options['product_ids'] and not options['all']:
+            raise CommandError("Укажите ID продуктов или --all")
+
+        products = Product.objects.select_related('type', 'client').order_by('id')
+        if options['product_ids']:
+            products = products.filter(id__in=options['product_ids'])
+        skipped = products.filter(paymentschedule__transaction__isnull=False).distinct().count()
+        products = products.exclude(paymentschedule__transaction__isnull=False)
+
+        batch_size = options['batch_size']
+        product_count = payment_count = 0
+        batch = []
+        for product in products.iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                payment_count += self.regenerate(batch, batch_size)
+                product_count += len(batch)
+                batch = []
+        if batch:
+            payment_count += self.regenerate(batch, batch_size)
+            product_count += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Продуктов обработано: {product_count}, платежей создано: {payment_count}, пропущено: {skipped}"
+        ))
+
+    @staticmethod
+    def regenerate(products, batch_size):
+        with transaction.atomic():
+            PaymentSchedule.objects.filter(product__in=products).delete()
+            return len(gen_payment_schedules(products, batch_size=batch_size))
@@ -0,0 +1,96 @@
+import json
+import contextlib
+import time
+import threading
+
+import schedule
+from django.core.management.base import BaseCommand
+
+import backup
+
+
+class Command(BaseCommand):
+    help = "Служба резервного копирования: инкрементальные бэкапы, политика хранения и проверка восстановления"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=60, help="Интервал между бэкапами, минут")
+        parser.add_argument('--verify-every', type=int, default=24, help="Проверять восстановление раз в N часов, 0 - не проверять")
+        parser.add_argument('--retries', type=int, default=3)
+        parser.add_argument('--backoff', type=float, default=60, help="Начальная пауза между попытками, секунд")
+        parser.add_argument('--local', help="Каталог локального хранилища вместо Яндекс.Диска")
+        parser.add_argument('--metrics-file', help="Дописывать метрики запусков в JSONL-файл")
+        parser.add_argument('--once', action='store_true', help="Выполнить один бэкап и завершиться")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.storage = backup.get_storage(options['local'])
+
+        if options['once']:
+            self.run_backup()
+            return
+
+        self.start(self.run_backup)
+        schedule.every(options['interval']).minutes.do(self.start, self.run_backup)
+        if options['verify_every']:
+            schedule.every(options['verify_every']).hours.do(self.start, self.run_verify)
+        self.stdout.write("Служба резервного копирования запущена")
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
+
+    def start(self, job):
+        threading.Thread(target=job, daemon=True).start()
+
+    def with_retry(self, name, func, locked=True):
+        # блокировка держится и во время пауз между попытками, чтобы другой запуск не вклинился
+        try:
+            with backup.backup_lock() if locked else contextlib.nullcontext():
+                for attempt in range(self.options['retries'] + 1):
+                    try:
+                        return func()
+                    except BlockingIOError:
+                        raise
+                    except Exception as e:
+                        if attempt == self.options['retries']:
+                            self.stderr.write(f"{name}: ошибка, попытки исчерпаны: {e!r}")
+                            return None
+                        delay = self.options['backoff'] * 2 ** attempt
+                        self.stderr.write(f"{name}: ошибка {e!r}, повтор через {delay:.0f} с")
+                        time.sleep(delay)
+        except BlockingIOError as e:
+            self.stderr.write(f"{name}: предыдущий запуск еще не завершен, пропуск ({e})")
+            return None
+
+    def run_backup(self):
+        def job():
+            metrics = backup.BackupMetrics()
+            manifest = backup.make_incremental_backup(self.storage, metrics)
+            with metrics.measure("retention"):
+                backup.apply_retention(self.storage)
+            return manifest, metrics.summary()
+
+        result = self.with_retry("Бэкап", job)
+        if result:
+            manifest, summary = result
+            self.record("backup", name=manifest['name'], size=manifest['size'],
+                        new_chunks=manifest['new_chunks'], uploaded_bytes=manifest['uploaded_bytes'], metrics=summary)
+
+    def run_verify(self):
+        def job():
+            name = self.storage.list(backup.MANIFESTS_DIR)[-1]
+            started = time.perf_counter()
+            tables = backup.verify_backup(self.storage, name)
+            return name, tables, time.perf_counter() - started
+
+        # verify_backup сам берет блокировку только на время копирования чанков
+        result = self.with_retry("Проверка восстановления", job, locked=False)
+        if result:
+            name, tables, duration = result
+            self.record("verify", name=name, tables=tables, seconds=round(duration, 3))
+
+    def record(self, event, **data):
+        line = json.dumps({"event": event, "time": time.strftime('%Y-%m-%dT%H:%M:%S'), **data}, ensure_ascii=False)
+        self.stdout.write(line)
+        if self.options['metrics_file']:
+            with open(self.options['metrics_file'], "a", encoding="utf-8") as f:
+                f.write(line + "\n")
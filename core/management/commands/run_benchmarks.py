@@ -0,0 +1,50 @@
+import json
+import logging
+from pathlib import Path
+
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmarks import run_benchmarks
+from core.models import Manager
+from core.settings import BENCHMARK_RESULTS_DIR
+
+
+class Command(BaseCommand):
+    help = "Замеряет генерацию графиков, отчеты, страницы админки, API и одобрение транзакций; результаты сохраняются в JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--sample-size', type=int, default=100, help="Размер выборки для пакетных замеров")
+        parser.add_argument('--only', nargs='*', help="Запустить только замеры, в названии которых есть эти строки")
+        parser.add_argument('--username', help="Пользователь, от имени которого открываются страницы")
+        parser.add_argument('--output', help="Файл результатов (по умолчанию в BENCHMARK_RESULTS_DIR)")
+        parser.add_argument('--compare', help="Файл предыдущего запуска для сравнения")
+
+    def handle(self, *args, **options):
+        users = Manager.objects.filter(is_active=True, is_staff=True)
+        user = users.filter(username=options['username']).first() if options['username'] else \
+            users.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError("Пользователь не найден")
+
+        previous = {}
+        if options['compare']:
+            previous = json.loads(Path(options['compare']).read_text(encoding="utf-8"))['benchmarks']
+
+        logging.getLogger('django.request').setLevel(logging.ERROR)
+
+        def progress(name, result):
+            line = f"{result['median'] * 1000:10.2f} мс  {result['queries']:5d} запр.  {name}"
+            if name in previous:
+                change = (result['median'] / previous[name]['median'] - 1) * 100 if previous[name]['median'] else 0
+                line += f"  ({change:+.1f}%)"
+            self.stdout.write(line)
+
+        results = run_benchmarks(
+            user, repeat=options['repeat'], sample_size=options['sample_size'], only=options['only'], progress=progress
+        )
+        output = Path(options['output'] or Path(BENCHMARK_RESULTS_DIR) / f"{timezone.now():%Y%m%d_%H%M%S}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+        self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {output}"))
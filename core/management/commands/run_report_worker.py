@@ -0,0 +1,47 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.jobs import claim_report_job, reset_stale_report_jobs, run_report_job
+from core.settings import PDF_WORKERS, PDF_RENDER_TIMEOUT, REPORT_MAX_RUNNING_JOBS, REPORT_POLL_INTERVAL
+
+
+class Command(BaseCommand):
+    help = "Обрабатывает очередь задач формирования отчетов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=PDF_WORKERS, help="Отчетов одновременно в этом процессе")
+        parser.add_argument('--max-running', type=int, default=REPORT_MAX_RUNNING_JOBS, help="Отчетов одновременно во всех процессах")
+        parser.add_argument('--poll-interval', type=float, default=REPORT_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true', help="Завершить работу, когда очередь опустеет")
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        reset = reset_stale_report_jobs(PDF_RENDER_TIMEOUT * 2)
+        if reset:
+            self.stdout.write(f"Возвращено в очередь зависших задач: {reset}")
+
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='report_job') as pool:
+            while True:
+                for future in [f for f in running if f.done()]:
+                    running.remove(future)
+                    self.report(future.result())
+
+                while len(running) < concurrency:
+                    job = claim_report_job(options['max_running'])
+                    if job is None:
+                        break
+                    running.add(pool.submit(run_report_job, job))
+
+                if options['once'] and not running:
+                    break
+                time.sleep(options['poll_interval'])
+
+    def report(self, job):
+        message = f"{job}: ожидание {job.wait_time:.2f} с, формирование {job.run_time:.2f} с"
+        if job.error:
+            self.stderr.write(f"{message}, {job.error}")
+        else:
+            self.stdout.write(message)
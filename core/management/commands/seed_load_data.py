@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.benchmarks import seed_schedule_data
+
+
+class Command(BaseCommand):
+    help = (
+        "Генерирует нагрузочные данные: клиентов с контактами, продукты, графики платежей и транзакции. "
+        "На PostgreSQL строки загружаются через COPY"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('clients', type=int, help="Количество клиентов")
+        parser.add_argument('--products-per-client', type=int, default=3, help="Среднее количество продуктов на клиента")
+        parser.add_argument('--batch-size', type=int, default=50000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--no-copy', action='store_true', help="Использовать INSERT вместо COPY")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(written):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"{elapsed:8.1f} с  " + ", ".join(f"{name}: {count}" for name, count in written.items())
+            )
+
+        written = seed_schedule_data(
+            options['clients'], products_per_client=options['products_per_client'], batch_size=options['batch_size'],
+            use_copy=False if options['no_copy'] else None, seed=options['seed'], progress=progress
+        )
+        elapsed = time.perf_counter() - started
+        total = sum(written.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Записано строк: {total} за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} строк/с). "
+            f"Пересчитайте портфели командой refresh_portfolios"
+        ))
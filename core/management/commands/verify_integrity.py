@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.integrity import verify_integrity
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет согласованность данных: клиента транзакций и платежей с владельцем продукта, контакт платежей "
+        "и связи платежей с транзакциями. Завершается с ошибкой, если нарушения остались"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Исправить нарушения, для которых известен эталон")
+        parser.add_argument('--sample', type=int, default=10, help="Сколько ID нарушителей выводить")
+        parser.add_argument('--batch-size', type=int, default=50000, help="Строк в одной транзакции при исправлении")
+
+    def handle(self, *args, **options):
+        remaining = 0
+        for check, count, fixed, ids in verify_integrity(options['fix'], options['sample'], options['batch_size']):
+            line = f"{check.description}: {count}"
+            if fixed:
+                line += f" (исправлено {fixed})"
+            if ids:
+                line += f", ID: {', '.join(map(str, ids))}{' …' if count > len(ids) else ''}"
+            self.stdout.write(line if count else self.style.SUCCESS(line))
+            remaining += count
+
+        if remaining:
+            raise CommandError(f"Обнаружено нарушений: {remaining}")
+        self.stdout.write(self.style.SUCCESS("Нарушений не обнаружено"))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_alter_transaction_approved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producttype',
+            name='schedule_mode',
+            field=models.CharField(blank=True, choices=[('annuity', 'Аннуитетный'), ('differentiated', 'Дифференцированный'), ('payout', 'Ежемесячная выплата процентов'), ('capitalization', 'Капитализация процентов')], help_text='По умолчанию: аннуитет для кредитов, ежемесячная выплата процентов для депозитов', max_length=20, null=True, verbose_name='Схема графика платежей'),
+        ),
+    ]
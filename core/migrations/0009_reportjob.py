@@ -0,0 +1,34 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_producttype_schedule_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_type', models.CharField(choices=[('pdf', 'PDF'), ('csv', 'CSV')], default='pdf', max_length=10, verbose_name='Формат')),
+                ('status', models.CharField(choices=[('queued', 'В очереди'), ('running', 'Формируется'), ('done', 'Готов'), ('failed', 'Ошибка')], db_index=True, default='queued', max_length=20, verbose_name='Статус')),
+                ('file', models.CharField(blank=True, max_length=500, verbose_name='Файл')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата запроса')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало формирования')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание формирования')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.product', verbose_name='Продукт')),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Запросил')),
+            ],
+            options={
+                'verbose_name': 'Задача формирования отчета',
+                'verbose_name_plural': 'Задачи формирования отчетов',
+            },
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:39
+
+from django.db import migrations, models
+
+TRIGRAM_INDEX_NAME = 'core_client_search_document_trgm'
+
+
+# копия core.search.build_client_search_document на момент миграции
+def build_client_search_document(client):
+    parts = [client.work_place or "", client.birth_date.isoformat() if client.birth_date else ""]
+    contact = client.contact
+    if contact:
+        parts += [
+            contact.name, contact.phone,
+            f"{contact.passport_series} {contact.passport_number}",
+            f"{contact.passport_series}{contact.passport_number}",
+        ]
+    return " ".join(p.strip() for p in parts if p and p.strip()).lower()
+
+
+def fill_search_documents(apps, schema_editor):
+    Client = apps.get_model('core', 'Client')
+    clients = list(Client.objects.select_related('contact'))
+    for client in clients:
+        client.search_document = build_client_search_document(client)
+    Client.objects.bulk_update(clients, ['search_document'], batch_size=1000)
+
+
+def add_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME} ON core_client USING gin (search_document gin_trgm_ops)"
+        )
+
+
+def remove_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TRIGRAM_INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_reportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='client',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Поисковый индекс'),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.RunPython(add_trigram_index, remove_trigram_index),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_client_search_document'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(fields=['product', 'scheduled_date'], name='payment_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(fields=['scheduled_date'], name='payment_scheduled_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(fields=['status', 'scheduled_date'], name='payment_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(fields=['actual_date'], name='payment_actual_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(condition=models.Q(('transaction__isnull', True)), fields=['scheduled_date'], name='payment_unpaid_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['date'], name='transaction_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['client', 'date'], name='transaction_client_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['product', 'date'], name='transaction_product_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'date'], name='transaction_status_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['type', 'date'], name='transaction_type_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('approved__isnull', True)), fields=['date'], name='transaction_pending_idx'),
+        ),
+    ]
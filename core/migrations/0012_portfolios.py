@@ -0,0 +1,45 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_schedule_and_transaction_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClientPortfolio',
+            fields=[
+                ('client', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='portfolio', serialize=False, to='core.client', verbose_name='Клиент')),
+                ('credit_debt', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Долг по кредитам')),
+                ('deposit_balance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Сумма депозитов')),
+                ('accrued_interest', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Начисленные проценты')),
+                ('next_due_date', models.DateField(blank=True, null=True, verbose_name='Ближайший платеж')),
+                ('overdue_count', models.IntegerField(default=0, verbose_name='Просроченных платежей')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Показатели клиента',
+                'verbose_name_plural': 'Показатели клиентов',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductPortfolio',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='portfolio', serialize=False, to='core.product', verbose_name='Продукт')),
+                ('principal_balance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Остаток основной суммы')),
+                ('accrued_interest', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Начисленные проценты')),
+                ('next_due_date', models.DateField(blank=True, null=True, verbose_name='Ближайший платеж')),
+                ('overdue_count', models.IntegerField(default=0, verbose_name='Просроченных платежей')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Обновлено')),
+            ],
+            options={
+                'verbose_name': 'Показатели продукта',
+                'verbose_name_plural': 'Показатели продуктов',
+            },
+        ),
+    ]
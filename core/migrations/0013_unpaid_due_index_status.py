@@ -0,0 +1,21 @@
+# Generated by Django 5.1.15 on 2026-10-17 11:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_portfolios'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentschedule',
+            name='payment_unpaid_due_idx',
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(condition=models.Q(('transaction__isnull', True)), fields=['scheduled_date', 'status'], name='payment_unpaid_due_idx'),
+        ),
+    ]
@@ -0,0 +1,316 @@
+import re
+import calendar
+from datetime import date
+from typing import NamedTuple
+
+import django.db.models.deletion
+from django.db import connection as default_connection, migrations, models, transaction
+
+# копия core.partitioning и core.schedule.add_months на момент миграции: последующие изменения модулей
+# не должны менять то, что делает уже примененная миграция
+PARTITION_AHEAD = 12
+
+
+def add_months(start: date, months: int):
+    month = start.month - 1 + months
+    year = start.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+BOUND_RE = re.compile(r"FROM \('(\d{4}-\d{2}-\d{2})[^']*'\) TO \('(\d{4}-\d{2}-\d{2})[^']*'\)")
+
+
+class PartitionSpec(NamedTuple):
+    table: str
+    key: str
+    interval: str
+    timestamp: bool
+
+
+class Partition(NamedTuple):
+    name: str
+    start: date
+    end: date
+    rows: int
+
+
+PARTITIONED_TABLES = [
+    PartitionSpec('core_paymentschedule', 'scheduled_date', 'year', False),
+    PartitionSpec('core_transaction', 'date', 'month', True),
+]
+
+
+def period_start(value: date, interval: str):
+    return date(value.year, 1, 1) if interval == 'year' else date(value.year, value.month, 1)
+
+
+def next_period(start: date, interval: str):
+    return date(start.year + 1, 1, 1) if interval == 'year' else add_months(start, 1)
+
+
+def partition_name(spec: PartitionSpec, start: date, table: str = None):
+    suffix = f"y{start:%Y}" if spec.interval == 'year' else f"m{start:%Y%m}"
+    return f"{table or spec.table}_{suffix}"
+
+
+def bound(spec: PartitionSpec, value: date):
+    return f"'{value.isoformat()} 00:00:00+00'" if spec.timestamp else f"'{value.isoformat()}'"
+
+
+def is_partitioned(cursor, table: str):
+    cursor.execute(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [table]
+    )
+    return cursor.fetchone()[0]
+
+
+def list_partitions(cursor, table: str):
+    cursor.execute(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), greatest(c.reltuples, 0)::bigint "
+        "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s) "
+        "ORDER BY c.relname", [table]
+    )
+    partitions = []
+    for name, expression, rows in cursor.fetchall():
+        match = BOUND_RE.search(expression)
+        start, end = (date.fromisoformat(match.group(1)), date.fromisoformat(match.group(2))) if match else (None, None)
+        partitions.append(Partition(name, start, end, rows))
+    return partitions
+
+
+def create_partition(cursor, spec: PartitionSpec, start: date, parent: str = None):
+    parent = parent or spec.table
+    name = partition_name(spec, start, spec.table)
+    end = next_period(start, spec.interval)
+    default = f"{spec.table}_default"
+    cursor.execute(f'CREATE TABLE "{name}" (LIKE "{parent}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    # строки периода, уже попавшие в партицию по умолчанию, переносятся до присоединения новой партиции
+    if any(p.name == default for p in list_partitions(cursor, parent)):
+        cursor.execute(
+            f'WITH moved AS (DELETE FROM "{default}" WHERE "{spec.key}" >= {bound(spec, start)} '
+            f'AND "{spec.key}" < {bound(spec, end)} RETURNING *) INSERT INTO "{name}" SELECT * FROM moved'
+        )
+    cursor.execute(
+        f'ALTER TABLE "{parent}" ATTACH PARTITION "{name}" FOR VALUES FROM ({bound(spec, start)}) TO ({bound(spec, end)})'
+    )
+    return name
+
+
+def ensure_partitions(spec: PartitionSpec, until: date, since: date = None, parent: str = None, connection=None):
+    connection = connection or default_connection
+    parent = parent or spec.table
+    created = []
+    with connection.cursor() as cursor:
+        existing = {p.start for p in list_partitions(cursor, parent) if p.start}
+        start = period_start(since or min(existing, default=date.today()), spec.interval)
+        while start <= until:
+            if start not in existing:
+                with transaction.atomic(using=connection.alias):
+                    created.append(create_partition(cursor, spec, start, parent))
+            start = next_period(start, spec.interval)
+    return created
+
+
+def get_table_indexes(cursor, table: str):
+    cursor.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid), x.indisunique, ARRAY(SELECT a.attname FROM unnest(x.indkey) k "
+        "JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = k) FROM pg_index x "
+        "JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary", [table]
+    )
+    return cursor.fetchall()
+
+
+def get_foreign_keys(cursor, table: str, incoming: bool = False):
+    cursor.execute(
+        "SELECT c.conname, pg_get_constraintdef(c.oid), src.relname, dst.relname FROM pg_constraint c "
+        "JOIN pg_class src ON src.oid = c.conrelid JOIN pg_class dst ON dst.oid = c.confrelid "
+        f"WHERE c.contype = 'f' AND c.{'confrelid' if incoming else 'conrelid'} = to_regclass(%s)", [table]
+    )
+    return cursor.fetchall()
+
+
+def create_unique_trigger(cursor, table: str, name: str, columns):
+    """Уникальность по столбцам без ключа секционирования: проверка всей таблицы под advisory-блокировкой
+    значения, чтобы параллельные транзакции не вставили одинаковые строки"""
+    new = " AND ".join(f'NEW."{column}" IS NOT NULL' for column in columns)
+    same = " AND ".join(f'"{column}" = NEW."{column}"' for column in columns)
+    values = ", ".join(f'NEW."{column}"' for column in columns)
+    targets = ", ".join(f'"{column}"' for column in columns)
+    cursor.execute(
+        f'CREATE FUNCTION "{name}_unique"() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+        f'IF {new} THEN '
+        f"PERFORM pg_advisory_xact_lock(hashtext('{table}.{name}'), hashtext(ROW({values})::text)); "
+        f'IF EXISTS (SELECT 1 FROM "{table}" WHERE {same} AND id <> NEW.id) THEN '
+        f"RAISE unique_violation USING MESSAGE = 'duplicate key value violates unique index \"{name}\"'; "
+        f'END IF; END IF; RETURN NEW; END $$'
+    )
+    cursor.execute(
+        f'CREATE TRIGGER "{name}_unique" BEFORE INSERT OR UPDATE OF {targets} '
+        f'ON "{table}" FOR EACH ROW EXECUTE FUNCTION "{name}_unique"()'
+    )
+
+
+def get_table_schema(cursor, table: str):
+    cursor.execute("SELECT relnamespace::regnamespace::text FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    return cursor.fetchone()[0]
+
+
+def copy_changes(cursor, spec: PartitionSpec, target: str):
+    changes = f"{spec.table}_changes"
+    cursor.execute(f'WITH changed AS (DELETE FROM "{changes}" RETURNING id) SELECT DISTINCT id FROM changed')
+    ids = [row[0] for row in cursor.fetchall()]
+    if ids:
+        cursor.execute(f'DELETE FROM "{target}" WHERE id = ANY(%s)', [ids])
+        cursor.execute(f'INSERT INTO "{target}" SELECT * FROM "{spec.table}" WHERE id = ANY(%s)', [ids])
+    return len(ids)
+
+
+def convert_to_partitioned(spec: PartitionSpec, batch_size: int = 50000, ahead: int = PARTITION_AHEAD, progress=None,
+                           connection=None):
+    """Переводит таблицу на секционирование без долгой блокировки: изменения во время копирования
+    фиксируются триггером и докатываются перед подменой таблицы"""
+    connection = connection or default_connection
+    table, key = spec.table, spec.key
+    target, changes = f"{table}_partitioned", f"{table}_changes"
+    atomic = lambda: transaction.atomic(using=connection.alias)
+    progress = progress or (lambda message: None)
+
+    with connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return False
+
+        with atomic():
+            cursor.execute(f'DROP TABLE IF EXISTS "{target}" CASCADE')
+            cursor.execute(f'DROP TABLE IF EXISTS "{changes}"')
+            cursor.execute(
+                f'CREATE TABLE "{target}" (LIKE "{table}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING IDENTITY) PARTITION BY RANGE ("{key}")'
+            )
+            cursor.execute(f'ALTER TABLE "{target}" ADD CONSTRAINT "{target}_pkey" PRIMARY KEY (id, "{key}")')
+            cursor.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{target}" DEFAULT')
+
+            cursor.execute(f'CREATE TABLE "{changes}" (id bigint NOT NULL)')
+            cursor.execute(
+                f'CREATE OR REPLACE FUNCTION "{changes}_log"() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+                f'INSERT INTO "{changes}" VALUES (CASE WHEN TG_OP = \'DELETE\' THEN OLD.id ELSE NEW.id END); '
+                f'RETURN NULL; END $$'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{changes}_log" AFTER INSERT OR UPDATE OR DELETE ON "{table}" '
+                f'FOR EACH ROW EXECUTE FUNCTION "{changes}_log"()'
+            )
+            cursor.execute(f'SELECT min("{key}"), max("{key}"), max(id) FROM "{table}"')
+            first, last, max_id = cursor.fetchone()
+
+        today = date.today()
+        if spec.timestamp and first:
+            first, last = first.date(), last.date()
+        until = add_months(max(last or today, today), ahead)
+        ensure_partitions(spec, until, since=first or today, parent=target, connection=connection)
+        progress(f"{table}: партиции созданы до {until}")
+
+        copied = 0
+        for low in range(0, max_id or 0, batch_size):
+            with atomic():
+                cursor.execute(
+                    f'INSERT INTO "{target}" SELECT * FROM "{table}" WHERE id > %s AND id <= %s', [low, low + batch_size]
+                )
+                copied += cursor.rowcount
+            progress(f"{table}: скопировано строк {copied}")
+
+        # pg_get_indexdef всегда указывает схему таблицы, а таблица может лежать не в public
+        schema = get_table_schema(cursor, table)
+        unique_checks = []
+        for name, definition, unique, columns in get_table_indexes(cursor, table):
+            definition = definition.replace(f" ON {schema}.{table} ", f" ON {schema}.{target} ", 1)
+            definition = definition.replace(f" INDEX {name} ", f" INDEX {name}_partitioned ", 1)
+            if unique and key not in columns:
+                # уникальный индекс без ключа секционирования не поддерживается: индекс остается обычным,
+                # а уникальность после подмены таблицы проверяет триггер
+                definition = definition.replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+                unique_checks.append((name, columns))
+            cursor.execute(definition)
+        partitioned = {s.table for s in PARTITIONED_TABLES}
+        for name, definition, _, referenced in get_foreign_keys(cursor, table):
+            if referenced not in partitioned:
+                cursor.execute(f'ALTER TABLE "{target}" ADD CONSTRAINT "{name}" {definition}')
+        progress(f"{table}: индексы и внешние ключи созданы")
+
+        while True:
+            with atomic():
+                if copy_changes(cursor, spec, target) < batch_size // 10:
+                    break
+
+        with atomic():
+            cursor.execute(f'LOCK TABLE "{table}" IN ACCESS EXCLUSIVE MODE')
+            copy_changes(cursor, spec, target)
+            cursor.execute(f'DROP TRIGGER "{changes}_log" ON "{table}"')
+            cursor.execute(f'DROP FUNCTION "{changes}_log"()')
+            cursor.execute(f'DROP TABLE "{changes}"')
+            for name, _, referencing, _ in get_foreign_keys(cursor, table, incoming=True):
+                cursor.execute(f'ALTER TABLE "{referencing}" DROP CONSTRAINT "{name}"')
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')))",
+                [target, table]
+            )
+            indexes = [name for name, *_ in get_table_indexes(cursor, table)]
+            cursor.execute(f'DROP TABLE "{table}"')
+            cursor.execute(f'ALTER TABLE "{target}" RENAME TO "{table}"')
+            cursor.execute(f'ALTER TABLE "{table}" RENAME CONSTRAINT "{target}_pkey" TO "{table}_pkey"')
+            cursor.execute(f'ALTER SEQUENCE "{target}_id_seq" RENAME TO "{table}_id_seq"')
+            for name in indexes:
+                cursor.execute(f'ALTER INDEX "{name}_partitioned" RENAME TO "{name}"')
+            for name, columns in unique_checks:
+                create_unique_trigger(cursor, table, name, columns)
+        progress(f"{table}: таблица переведена на секционирование")
+    return True
+
+
+def partition_tables(batch_size: int = 50000, ahead: int = PARTITION_AHEAD, progress=None, connection=None):
+    connection = connection or default_connection
+    if connection.vendor != 'postgresql':
+        return []
+    return [spec.table for spec in PARTITIONED_TABLES if convert_to_partitioned(spec, batch_size, ahead, progress, connection)]
+
+
+
+def convert_tables(apps, schema_editor):
+    partition_tables(connection=schema_editor.connection)
+
+
+class AlterTransactionField(migrations.AlterField):
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        # откат секционирование не отменяет, а внешний ключ на секционированную core_transaction невозможен,
+        # поэтому откатывается только состояние
+        if schema_editor.connection.vendor == 'postgresql':
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))",
+                    ['core_paymentschedule']
+                )
+                if cursor.fetchone()[0]:
+                    return
+        super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+    # копирование выполняется пакетами в отдельных транзакциях, чтобы не держать блокировки на время переноса
+    atomic = False
+
+    dependencies = [
+        ('core', '0013_unpaid_due_index_status'),
+    ]
+
+    operations = [
+        # на секционированную core_transaction нельзя сослаться внешним ключом, поэтому ограничение снимается
+        # до переноса данных; уникальность transaction_id после секционирования проверяет триггер
+        AlterTransactionField(
+            model_name='paymentschedule',
+            name='transaction',
+            field=models.OneToOneField(
+                blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                to='core.transaction', verbose_name='Связанная транзакция'
+            ),
+        ),
+        migrations.RunPython(convert_tables, migrations.RunPython.noop),
+    ]
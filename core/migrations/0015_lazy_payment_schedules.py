@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-17 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_partition_schedules_and_transactions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentschedule',
+            name='installment',
+            field=models.IntegerField(blank=True, null=True, verbose_name='Номер платежа'),
+        ),
+        migrations.AddField(
+            model_name='producttype',
+            name='lazy_schedule',
+            field=models.BooleanField(default=False, help_text='График рассчитывается по условиям продукта при просмотре, в базе сохраняются только платежи с транзакцией или ручными изменениями', verbose_name='Вычислять график по требованию'),
+        ),
+    ]
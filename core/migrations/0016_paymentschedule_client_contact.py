@@ -0,0 +1,89 @@
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+
+# копия исправлений и ограничений core.integrity на момент миграции: последующие изменения модуля
+# не должны менять то, что делает уже примененная миграция
+CLIENT_KEY_FIXES = [
+    ('core_transaction',
+     "UPDATE core_transaction AS t SET client_id = p.client_id FROM core_product p "
+     "WHERE p.id = t.product_id AND t.client_id <> p.client_id"),
+    ('core_paymentschedule',
+     "UPDATE core_paymentschedule AS t SET client_id = p.client_id FROM core_product p "
+     "WHERE p.id = t.product_id AND (t.client_id IS NULL OR t.client_id <> p.client_id)"),
+    ('core_paymentschedule',
+     "UPDATE core_paymentschedule AS t SET contact_id = c.contact_id FROM core_client c "
+     "WHERE c.id = t.client_id AND (t.contact_id <> c.contact_id OR (t.contact_id IS NULL) <> (c.contact_id IS NULL))"),
+]
+
+CONSTRAINTS = [
+    ('core_product', 'core_product_id_client_uniq', "UNIQUE (id, client_id)"),
+    ('core_client', 'core_client_id_contact_uniq', "UNIQUE (id, contact_id)"),
+    ('core_transaction', 'core_transaction_product_client_fk',
+     "FOREIGN KEY (product_id, client_id) REFERENCES core_product (id, client_id) "
+     "ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED"),
+    ('core_paymentschedule', 'core_paymentschedule_product_client_fk',
+     "FOREIGN KEY (product_id, client_id) REFERENCES core_product (id, client_id) "
+     "ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED"),
+    ('core_paymentschedule', 'core_paymentschedule_client_contact_fk',
+     "FOREIGN KEY (client_id, contact_id) REFERENCES core_client (id, contact_id) "
+     "ON UPDATE CASCADE DEFERRABLE INITIALLY DEFERRED"),
+]
+
+
+def fill_client_keys(apps, schema_editor, batch_size: int = 50000):
+    # владелец продукта считается эталоном: расходящиеся транзакции исправляются до создания ограничений
+    connection = schema_editor.connection
+    with connection.cursor() as cursor:
+        for table, fix in CLIENT_KEY_FIXES:
+            cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+            low, high = cursor.fetchone()
+            if low is None:
+                continue
+            for start in range(low - 1, high, batch_size):
+                with transaction.atomic(using=connection.alias):
+                    cursor.execute(f"{fix} AND t.id > %s AND t.id <= %s", [start, start + batch_size])
+
+
+def add_integrity_constraints(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for table, name, definition in CONSTRAINTS:
+            schema_editor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+
+
+def remove_integrity_constraints(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for table, name, _ in reversed(CONSTRAINTS):
+            schema_editor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+
+
+class Migration(migrations.Migration):
+    # заполнение выполняется пакетами в отдельных транзакциях
+    atomic = False
+
+    dependencies = [
+        ('core', '0015_lazy_payment_schedules'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentschedule',
+            name='client',
+            field=models.ForeignKey(db_index=False, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.client', verbose_name='Клиент'),
+        ),
+        migrations.AddField(
+            model_name='paymentschedule',
+            name='contact',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.contact', verbose_name='Контактные данные'),
+        ),
+        migrations.RunPython(fill_client_keys, migrations.RunPython.noop, atomic=False),
+        migrations.AlterField(
+            model_name='paymentschedule',
+            name='client',
+            field=models.ForeignKey(db_index=False, editable=False, on_delete=django.db.models.deletion.CASCADE, to='core.client', verbose_name='Клиент'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentschedule',
+            index=models.Index(fields=['client', 'scheduled_date'], name='payment_client_date_idx'),
+        ),
+        migrations.RunPython(add_integrity_constraints, remove_integrity_constraints),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.1.15 on 2026-10-17 13:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_paymentschedule_client_contact'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='reportjob',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='core.product', verbose_name='Продукт'),
+        ),
+        migrations.AddField(
+            model_name='reportjob',
+            name='products',
+            field=models.ManyToManyField(blank=True, related_name='archive_jobs', to='core.product', verbose_name='Продукты архива'),
+        ),
+    ]
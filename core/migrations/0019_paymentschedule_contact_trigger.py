@@ -0,0 +1,33 @@
+from django.db import migrations
+
+
+def create_contact_trigger(apps, schema_editor):
+    # каскадная смена клиента в core_paymentschedule (product_id, client_id) не меняет contact_id,
+    # и ограничение (client_id, contact_id) не проходило бы, поэтому контакт берется у нового клиента
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE FUNCTION core_paymentschedule_sync_contact() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+            "SELECT contact_id INTO NEW.contact_id FROM core_client WHERE id = NEW.client_id; RETURN NEW; END $$"
+        )
+        schema_editor.execute(
+            "CREATE TRIGGER core_paymentschedule_sync_contact BEFORE UPDATE OF client_id ON core_paymentschedule "
+            "FOR EACH ROW WHEN (NEW.client_id IS DISTINCT FROM OLD.client_id) "
+            "EXECUTE FUNCTION core_paymentschedule_sync_contact()"
+        )
+
+
+def drop_contact_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP TRIGGER IF EXISTS core_paymentschedule_sync_contact ON core_paymentschedule")
+        schema_editor.execute("DROP FUNCTION IF EXISTS core_paymentschedule_sync_contact()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_cache_table'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_contact_trigger, drop_contact_trigger),
+    ]
@@ -1,6 +1,11 @@
+from django.core.exceptions import ValidationError
 from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser, Permission
 
+from core.references import references
+from core.schedule import SCHEDULE_MODES
+from core.search import build_client_search_document
+
 
 class Contact(models.Model):
     name = models.CharField(max_length=1000, verbose_name="ФИО")
@@ -23,6 +28,13 @@ class Client(models.Model):
     birth_date = models.DateField(null=True, blank=True, verbose_name="Дата рождения")
     gender = models.CharField(max_length=10, choices=(('M', 'Мужской'), ('F', 'Женский')), null=True, blank=True, verbose_name="Пол")
     contact = models.OneToOneField('Contact', on_delete=models.CASCADE, null=True, blank=True, verbose_name="Контактные данные")
+    search_document = models.TextField(blank=True, default="", editable=False, verbose_name="Поисковый индекс")
+
+    def save(self, *args, **kwargs):
+        self.search_document = build_client_search_document(self)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'search_document'}
+        super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Клиент"
@@ -75,6 +87,20 @@ class ProductType(models.Model):
         default='credit',
         verbose_name="Поведение типа"
     )
+    schedule_mode = models.CharField(
+        max_length=20,
+        choices=SCHEDULE_MODES,
+        null=True,
+        blank=True,
+        verbose_name="Схема графика платежей",
+        help_text="По умолчанию: аннуитет для кредитов, ежемесячная выплата процентов для депозитов"
+    )
+    lazy_schedule = models.BooleanField(
+        default=False,
+        verbose_name="Вычислять график по требованию",
+        help_text="График рассчитывается по условиям продукта при просмотре, в базе сохраняются только платежи "
+                  "с транзакцией или ручными изменениями"
+    )
 
     class Meta:
         verbose_name = "Тип банковского продукта"
@@ -117,7 +143,8 @@ class Product(models.Model):
         verbose_name_plural = "Продукты"
 
     def __str__(self):
-        return f"{self.type.name if self.type else self._meta.verbose_name} ID{self.id} - {self.amount} руб на {self.duration} месяцев под {self.interest_rate}% годовых"
+        product_type = references.get(ProductType, self.type_id)
+        return f"{product_type.name if product_type else self._meta.verbose_name} ID{self.id} - {self.amount} руб на {self.duration} месяцев под {self.interest_rate}% годовых"
 
 
 class PaymentStatus(models.Model):
@@ -133,15 +160,49 @@ class PaymentStatus(models.Model):
 
 class PaymentSchedule(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Продукт")
+    # клиент и контакт продукта дублируются для поиска и отображения без соединения через продукт
+    client = models.ForeignKey(Client, on_delete=models.CASCADE, db_index=False, editable=False, verbose_name="Клиент")
+    contact = models.ForeignKey(
+        Contact, on_delete=models.SET_NULL, null=True, editable=False, verbose_name="Контактные данные"
+    )
+    installment = models.IntegerField(null=True, blank=True, verbose_name="Номер платежа")
     amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Сумма платежа")
     scheduled_date = models.DateField(verbose_name="Запланированная дата платежа")
     actual_date = models.DateField(null=True, blank=True, verbose_name="Фактическая дата платежа")
     status = models.ForeignKey(PaymentStatus, on_delete=models.SET_NULL, null=True, verbose_name="Статус платежа")
-    transaction = models.OneToOneField('Transaction', on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Связанная транзакция")
+    # внешний ключ на секционированную core_transaction невозможен; уникальность на секционированной
+    # core_paymentschedule вместо ограничения проверяет триггер (см. core.partitioning)
+    transaction = models.OneToOneField(
+        'Transaction', on_delete=models.SET_NULL, null=True, blank=True, db_constraint=False,
+        verbose_name="Связанная транзакция"
+    )
 
     class Meta:
         verbose_name = "График платежей"
         verbose_name_plural = "Графики платежей"
+        indexes = [
+            models.Index(fields=['product', 'scheduled_date'], name='payment_product_date_idx'),
+            models.Index(fields=['client', 'scheduled_date'], name='payment_client_date_idx'),
+            models.Index(fields=['scheduled_date'], name='payment_scheduled_date_idx'),
+            models.Index(fields=['status', 'scheduled_date'], name='payment_status_date_idx'),
+            models.Index(fields=['actual_date'], name='payment_actual_date_idx'),
+            models.Index(
+                fields=['scheduled_date', 'status'], condition=models.Q(transaction__isnull=True),
+                name='payment_unpaid_due_idx'
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        # владелец сверяется только с уже загруженным продуктом, чтобы сохранение не стоило лишнего запроса;
+        # смену владельца через update() переносят в платежи ограничения и триггер PostgreSQL (core.integrity)
+        product_field = self._meta.get_field('product')
+        if self.client_id is None or product_field.is_cached(self) and self.client_id != self.product.client_id:
+            self.client_id, self.contact_id = Product.objects.filter(id=self.product_id).values_list(
+                'client_id', 'client__contact_id'
+            ).get()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'client', 'contact'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Платеж {self.amount} руб. на {self.scheduled_date}"
@@ -191,8 +252,94 @@ class Transaction(models.Model):
     class Meta:
         verbose_name = "Транзакция"
         verbose_name_plural = "Транзакции"
+        indexes = [
+            models.Index(fields=['date'], name='transaction_date_idx'),
+            models.Index(fields=['client', 'date'], name='transaction_client_date_idx'),
+            models.Index(fields=['product', 'date'], name='transaction_product_date_idx'),
+            models.Index(fields=['status', 'date'], name='transaction_status_date_idx'),
+            models.Index(fields=['type', 'date'], name='transaction_type_date_idx'),
+            models.Index(fields=['date'], condition=models.Q(approved__isnull=True), name='transaction_pending_idx'),
+        ]
 
         permissions = [("approve_transaction", "Может одобрять транзакции")]
 
+    def clean(self):
+        if self.product_id and self.client_id and self.product.client_id != self.client_id:
+            raise ValidationError({'client': "Клиент транзакции должен совпадать с владельцем продукта."})
+
     def __str__(self):
-        return f"{self._meta.verbose_name} ID{self.id} ({self.status.name})"
+        status = references.get(TransactionStatus, self.status_id)
+        return f"{self._meta.verbose_name} ID{self.id} ({status.name if status else 'без статуса'})"
+
+
+class ReportJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, verbose_name="Продукт")
+    # задача без продукта формирует ZIP-архив отчетов по всем продуктам из products
+    products = models.ManyToManyField(Product, blank=True, related_name="archive_jobs", verbose_name="Продукты архива")
+    report_type = models.CharField(max_length=10, choices=[('pdf', 'PDF'), ('csv', 'CSV')], default='pdf', verbose_name="Формат")
+    status = models.CharField(
+        max_length=20,
+        choices=[(QUEUED, 'В очереди'), (RUNNING, 'Формируется'), (DONE, 'Готов'), (FAILED, 'Ошибка')],
+        default=QUEUED,
+        db_index=True,
+        verbose_name="Статус"
+    )
+    requested_by = models.ForeignKey("Manager", on_delete=models.SET_NULL, null=True, blank=True, verbose_name="Запросил")
+    file = models.CharField(max_length=500, blank=True, verbose_name="Файл")
+    error = models.TextField(blank=True, verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата запроса")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начало формирования")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Окончание формирования")
+
+    class Meta:
+        verbose_name = "Задача формирования отчета"
+        verbose_name_plural = "Задачи формирования отчетов"
+
+    @property
+    def wait_time(self):
+        return (self.started_at - self.created_at).total_seconds() if self.started_at else None
+
+    @property
+    def run_time(self):
+        return (self.finished_at - self.started_at).total_seconds() if self.finished_at and self.started_at else None
+
+    @property
+    def is_archive(self):
+        return self.product_id is None
+
+    def __str__(self):
+        if self.is_archive:
+            return f"Архив отчетов {self.report_type.upper()} ({self.get_status_display()})"
+        return f"Отчет {self.report_type.upper()} по продукту ID{self.product_id} ({self.get_status_display()})"
+
+
+class ProductPortfolio(models.Model):
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name="portfolio", verbose_name="Продукт")
+    principal_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Остаток основной суммы")
+    accrued_interest = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Начисленные проценты")
+    next_due_date = models.DateField(null=True, blank=True, verbose_name="Ближайший платеж")
+    overdue_count = models.IntegerField(default=0, verbose_name="Просроченных платежей")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Показатели продукта"
+        verbose_name_plural = "Показатели продуктов"
+
+
+class ClientPortfolio(models.Model):
+    client = models.OneToOneField(Client, on_delete=models.CASCADE, primary_key=True, related_name="portfolio", verbose_name="Клиент")
+    credit_debt = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Долг по кредитам")
+    deposit_balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Сумма депозитов")
+    accrued_interest = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Начисленные проценты")
+    next_due_date = models.DateField(null=True, blank=True, verbose_name="Ближайший платеж")
+    overdue_count = models.IntegerField(default=0, verbose_name="Просроченных платежей")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Обновлено")
+
+    class Meta:
+        verbose_name = "Показатели клиента"
+        verbose_name_plural = "Показатели клиентов"
@@ -0,0 +1,84 @@
+from datetime import date
+from collections import defaultdict
+
+from django.db.models import Q, Sum, Min
+from django.db.models.functions import Coalesce
+
+from core.models import Product, PaymentSchedule, ProductPortfolio, ClientPortfolio
+from core.schedule import compute_product_schedule, missing_installments, split_payments, ZERO
+
+PRODUCT_PORTFOLIO_FIELDS = ['principal_balance', 'accrued_interest', 'next_due_date', 'overdue_count']
+CLIENT_PORTFOLIO_FIELDS = ['credit_debt', 'deposit_balance', 'accrued_interest', 'next_due_date', 'overdue_count']
+
+
+def calculate_product_portfolio(product: Product, payments, today: date):
+    # payments — четверки (номер платежа, дата, сумма, оплачен) сохраненных строк графика
+    schedule = compute_product_schedule(product)
+    if product.type.lazy_schedule:
+        # несохраненные платежи графика по требованию считаются неоплаченными
+        saved = [(number, scheduled_date) for number, scheduled_date, _, _ in payments]
+        payments = payments + [(i.number, i.date, i.amount, False) for i in missing_installments(schedule, saved)]
+    splits = split_payments(schedule, product.amount, [(number, d, amount) for number, d, amount, _ in payments])
+    unpaid_dates = [scheduled_date for _, scheduled_date, _, paid in payments if not paid]
+    return ProductPortfolio(
+        product=product,
+        principal_balance=product.amount - sum(
+            (principal for (*_, paid), (_, principal) in zip(payments, splits) if paid), ZERO
+        ),
+        accrued_interest=sum(
+            (interest for (_, scheduled_date, *_), (interest, _) in zip(payments, splits) if scheduled_date <= today), ZERO
+        ),
+        next_due_date=min(unpaid_dates, default=None),
+        overdue_count=sum(1 for d in unpaid_dates if d < today),
+    )
+
+
+def refresh_product_portfolios(product_ids, today: date = None):
+    today = today or date.today()
+    payments = defaultdict(list)
+    rows = PaymentSchedule.objects.filter(product_id__in=product_ids).order_by('scheduled_date', 'id').values_list(
+        'product_id', 'installment', 'scheduled_date', 'amount', 'transaction_id', 'transaction__approved'
+    )
+    for product_id, installment, scheduled_date, amount, transaction_id, approved in rows:
+        payments[product_id].append((
+            installment, scheduled_date, amount, transaction_id is not None and approved is not False
+        ))
+
+    portfolios = [
+        calculate_product_portfolio(product, payments[product.id], today)
+        for product in Product.objects.filter(id__in=product_ids).select_related('type')
+    ]
+    ProductPortfolio.objects.bulk_create(
+        portfolios, update_conflicts=True, unique_fields=['product'], update_fields=PRODUCT_PORTFOLIO_FIELDS + ['updated_at']
+    )
+    return portfolios
+
+
+def refresh_client_portfolios(client_ids):
+    credit, deposit = Q(product__type__behavior='credit'), Q(product__type__behavior='deposit')
+    totals = ProductPortfolio.objects.filter(product__client_id__in=client_ids).values('product__client_id').annotate(
+        credit_debt=Coalesce(Sum('principal_balance', filter=credit), ZERO),
+        deposit_balance=Coalesce(Sum('principal_balance', filter=deposit), ZERO),
+        total_interest=Sum('accrued_interest'),
+        first_due_date=Min('next_due_date'),
+        total_overdue=Sum('overdue_count'),
+    )
+    portfolios = [ClientPortfolio(
+        client_id=row['product__client_id'], credit_debt=row['credit_debt'], deposit_balance=row['deposit_balance'],
+        accrued_interest=row['total_interest'], next_due_date=row['first_due_date'], overdue_count=row['total_overdue'],
+    ) for row in totals]
+    ClientPortfolio.objects.bulk_create(
+        portfolios, update_conflicts=True, unique_fields=['client'], update_fields=CLIENT_PORTFOLIO_FIELDS + ['updated_at']
+    )
+    ClientPortfolio.objects.filter(client_id__in=client_ids).exclude(
+        client_id__in=[p.client_id for p in portfolios]
+    ).delete()
+    return portfolios
+
+
+def refresh_portfolios(product_ids, client_ids=()):
+    product_ids = set(product_ids)
+    refresh_product_portfolios(product_ids)
+    refresh_client_portfolios(
+        set(client_ids) | set(Product.objects.filter(id__in=product_ids).values_list('client_id', flat=True))
+    )
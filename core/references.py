@@ -0,0 +1,74 @@
+import time
+import threading
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+from core.settings import REFERENCES_CHECK_INTERVAL
+
+REFERENCES_VERSION_KEY = "core:references:version"
+REFERENCE_MODELS = ['PaymentStatus', 'TransactionStatus', 'ProductStatus', 'ProductType', 'TransactionType']
+
+
+class ReferenceRegistry:
+    def __init__(self, model_names):
+        self.model_names = model_names
+        self._tables = {}
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def models(self):
+        return [apps.get_model('core', name) for name in self.model_names]
+
+    def _sync(self):
+        now = time.monotonic()
+        if now - self._checked_at < REFERENCES_CHECK_INTERVAL:
+            return
+        version = cache.get_or_set(REFERENCES_VERSION_KEY, 1, None)
+        if version != self._version:
+            self._tables = {}
+            self._version = version
+        self._checked_at = now
+
+    def _table(self, model):
+        self._sync()
+        table = self._tables.get(model)
+        if table is None:
+            with self._lock:
+                objects = list(model.objects.all())
+                table = {'id': {o.id: o for o in objects}, 'name': {o.name: o for o in objects}}
+                self._tables = {**self._tables, model: table}
+        return table
+
+    def all(self, model):
+        return list(self._table(model)['id'].values())
+
+    def get(self, model, pk):
+        if pk is None:
+            return None
+        return self._table(model)['id'].get(pk)
+
+    def by_name(self, model, name):
+        return self._table(model)['name'].get(name)
+
+    def get_or_create(self, model, name):
+        obj = self.by_name(model, name)
+        if obj is None:
+            obj = model.objects.get_or_create(name=name)[0]
+            # до фиксации новая строка не видна другим процессам, и они перечитали бы справочник без нее
+            transaction.on_commit(self.invalidate)
+        return obj
+
+    def invalidate(self):
+        try:
+            cache.incr(REFERENCES_VERSION_KEY)
+        except ValueError:
+            cache.set(REFERENCES_VERSION_KEY, 1, None)
+        self._tables = {}
+        self._checked_at = 0.0
+
+
+references = ReferenceRegistry(REFERENCE_MODELS)
@@ -0,0 +1,178 @@
+import os
+import asyncio
+import hashlib
+import zipfile
+import weakref
+import django
+import pdfkit
+from pathlib import Path
+from collections import deque
+from itertools import islice
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from jinja2 import Environment, FileSystemLoader
+from asgiref.sync import sync_to_async
+
+from core.instrumentation import timed
+from core.models import Product
+from core.utils import get_payment_schedule_table, get_payment_schedules, stream_payment_schedule_csv
+from core.settings import WKHTMLTOPDF_PATH, PRODUCT_TYPES, PDF_WORKERS, PDF_RENDER_TIMEOUT, REPORT_CACHE_DIR
+
+TEMPLATES_DIR = Path(__file__).resolve().parent / 'templates' / 'core'
+
+templates = Environment(loader=FileSystemLoader(TEMPLATES_DIR), auto_reload=False)
+pdf_pool = ThreadPoolExecutor(max_workers=PDF_WORKERS, thread_name_prefix='pdf_render')
+pdf_semaphores = weakref.WeakKeyDictionary()
+
+
+@lru_cache(maxsize=1)
+def get_pdfkit_configuration():
+    return pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+
+
+def render_payment_schedule_html(product: Product, payments=None):
+    data = get_payment_schedule_table(product, payments)
+    with timed('template'):
+        return templates.get_template('pdf_report.html').render(
+            data=data['table'],
+            product_id=product.id,
+            client_name=product.client.contact.name,
+            client_phone=product.client.contact.phone,
+            product_type=PRODUCT_TYPES[product.type.behavior],
+            product_amount=product.amount,
+            interest_rate=product.interest_rate,
+            product_duration=product.duration,
+            interest_amount=data['interest_amount']
+        )
+
+
+def html_to_pdf(html: str):
+    return pdfkit.from_string(html, False, configuration=get_pdfkit_configuration())
+
+
+def render_pdf(html: str):
+    with timed('pdf'):
+        return pdf_pool.submit(html_to_pdf, html).result(timeout=PDF_RENDER_TIMEOUT)
+
+
+def get_pdf_semaphore():
+    # семафор привязывается к циклу событий при первом ожидании, поэтому у каждого цикла он свой
+    loop = asyncio.get_running_loop()
+    if loop not in pdf_semaphores:
+        pdf_semaphores[loop] = asyncio.Semaphore(PDF_WORKERS)
+    return pdf_semaphores[loop]
+
+
+async def html_to_pdf_async(html: str):
+    async with get_pdf_semaphore():
+        with timed('pdf'):
+            process = await asyncio.create_subprocess_exec(
+                WKHTMLTOPDF_PATH, '--quiet', '-', '-',
+                stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                content, errors = await asyncio.wait_for(process.communicate(html.encode("utf-8")), PDF_RENDER_TIMEOUT)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                raise
+    if process.returncode != 0 or not content:
+        raise IOError(f"wkhtmltopdf exited with code {process.returncode}: {errors.decode(errors='replace')}")
+    return content
+
+
+def get_cached_pdf_path(product_id: int, version: str):
+    return Path(REPORT_CACHE_DIR) / f"ps_{product_id}_{version}.pdf"
+
+
+def clear_cached_pdfs(product_ids):
+    for product_id in product_ids:
+        for path in Path(REPORT_CACHE_DIR).glob(f"ps_{product_id}_*.pdf"):
+            path.unlink(missing_ok=True)
+
+
+def get_html_version(html: str):
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()[:16]
+
+
+def get_cached_payment_schedule_pdf(product: Product):
+    path = get_cached_pdf_path(product.id, get_html_version(render_payment_schedule_html(product)))
+    return path if path.exists() else None
+
+
+def generate_payment_schedule_pdf(product: Product):
+    html = render_payment_schedule_html(product)
+    path = get_cached_pdf_path(product.id, get_html_version(html))
+    if path.exists():
+        return path
+    return store_pdf(path, product.id, render_pdf(html))
+
+
+async def generate_payment_schedule_pdf_async(product: Product):
+    html = await sync_to_async(render_payment_schedule_html)(product)
+    path = get_cached_pdf_path(product.id, get_html_version(html))
+    if path.exists():
+        return path
+    content = await html_to_pdf_async(html)
+    return await sync_to_async(store_pdf)(path, product.id, content)
+
+
+def store_pdf(path: Path, product_id: int, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+    for stale in path.parent.glob(f"ps_{product_id}_*.pdf"):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+    return path
+
+
+def iter_products_with_schedules(products, chunk_size: int = 500):
+    # графики загружаются одним запросом на пачку продуктов, а не отдельным запросом на каждый продукт
+    products = products.select_related('type', 'client__contact').order_by('id').iterator(chunk_size=chunk_size)
+    while chunk := list(islice(products, chunk_size)):
+        schedules = get_payment_schedules(chunk)
+        for product in chunk:
+            yield product, schedules[product.id]
+
+
+def iter_payment_schedule_pdfs(products, workers: int = PDF_WORKERS):
+    # products — пары (продукт, график), см. iter_products_with_schedules
+    pending = deque()
+    # при запуске процессов через spawn/forkserver дочерний процесс импортирует core.reports вместе с моделями,
+    # поэтому Django настраивается до получения первой задачи
+    with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+        for product, payments in products:
+            html = render_payment_schedule_html(product, payments)
+            path = get_cached_pdf_path(product.id, get_html_version(html))
+            if path.exists():
+                yield product.id, path.read_bytes()
+                continue
+
+            pending.append((product.id, path, pool.submit(html_to_pdf, html)))
+            while len(pending) >= workers * 4 or (pending and pending[0][2].done()):
+                product_id, path, future = pending.popleft()
+                yield product_id, store_pdf(path, product_id, future.result(timeout=PDF_RENDER_TIMEOUT)).read_bytes()
+
+        for product_id, path, future in pending:
+            yield product_id, store_pdf(path, product_id, future.result(timeout=PDF_RENDER_TIMEOUT)).read_bytes()
+
+
+def write_reports_archive(products, report_type: str, fileobj, workers: int = PDF_WORKERS):
+    products = iter_products_with_schedules(products)
+    if report_type == 'pdf':
+        reports = iter_payment_schedule_pdfs(products, workers)
+    else:
+        reports = (
+            (product.id, "".join(stream_payment_schedule_csv(product, payments)).encode("utf-8"))
+            for product, payments in products
+        )
+
+    count = 0
+    with zipfile.ZipFile(fileobj, "w", zipfile.ZIP_DEFLATED) as archive:
+        for product_id, content in reports:
+            archive.writestr(f"ps_{product_id}.{report_type}", content)
+            count += 1
+    return count
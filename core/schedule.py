@@ -0,0 +1,153 @@
+import calendar
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import NamedTuple
+
+CENT = Decimal('0.01')
+ZERO = Decimal('0.00')
+
+ANNUITY = 'annuity'
+DIFFERENTIATED = 'differentiated'
+PAYOUT = 'payout'
+CAPITALIZATION = 'capitalization'
+
+SCHEDULE_MODES = [
+    (ANNUITY, 'Аннуитетный'),
+    (DIFFERENTIATED, 'Дифференцированный'),
+    (PAYOUT, 'Ежемесячная выплата процентов'),
+    (CAPITALIZATION, 'Капитализация процентов'),
+]
+DEFAULT_MODES = {
+    'credit': ANNUITY,
+    'deposit': PAYOUT,
+}
+
+
+class Installment(NamedTuple):
+    number: int
+    date: date
+    amount: Decimal
+    interest: Decimal
+    principal: Decimal
+    balance: Decimal
+
+
+def add_months(start: date, months: int):
+    month = start.month - 1 + months
+    year = start.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(start.day, calendar.monthrange(year, month)[1]))
+
+
+def _round(value: Decimal):
+    return value.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+@lru_cache(maxsize=4096)
+def monthly_rate(interest_rate: Decimal):
+    return Decimal(interest_rate) / 1200
+
+
+@lru_cache(maxsize=4096)
+def annuity_factor(interest_rate: Decimal, duration: int):
+    rate = monthly_rate(interest_rate)
+    if not rate:
+        return Decimal(1) / duration
+    growth = (1 + rate) ** duration
+    return rate * growth / (growth - 1)
+
+
+def _annuity(amount, rate, duration):
+    payment = _round(amount * annuity_factor(rate, duration))
+    balance = amount
+    for month in range(1, duration + 1):
+        interest = _round(balance * monthly_rate(rate))
+        principal = balance if month == duration else payment - interest
+        balance -= principal
+        yield interest + principal, interest, principal, balance
+
+
+def _differentiated(amount, rate, duration):
+    base_principal = _round(amount / duration)
+    balance = amount
+    for month in range(1, duration + 1):
+        interest = _round(balance * monthly_rate(rate))
+        principal = balance if month == duration else base_principal
+        balance -= principal
+        yield interest + principal, interest, principal, balance
+
+
+def _payout(amount, rate, duration):
+    interest = _round(amount * monthly_rate(rate))
+    for month in range(1, duration + 1):
+        principal = amount if month == duration else ZERO
+        yield interest + principal, interest, principal, amount - principal
+
+
+def _capitalization(amount, rate, duration):
+    balance = amount
+    for month in range(1, duration + 1):
+        interest = _round(balance * monthly_rate(rate))
+        balance += interest
+        if month == duration:
+            yield balance, interest, amount, ZERO
+        else:
+            yield ZERO, interest, ZERO, balance
+
+
+CALCULATORS = {
+    ANNUITY: _annuity,
+    DIFFERENTIATED: _differentiated,
+    PAYOUT: _payout,
+    CAPITALIZATION: _capitalization,
+}
+
+
+def compute_schedule(amount, interest_rate, duration: int, mode: str, start_date: date):
+    amount = _round(Decimal(amount))
+    interest_rate = Decimal(interest_rate)
+    return [
+        Installment(month, add_months(start_date, month), *row)
+        for month, row in enumerate(CALCULATORS[mode](amount, interest_rate, duration), start=1)
+    ]
+
+
+def get_schedule_mode(product_type):
+    return product_type.schedule_mode or DEFAULT_MODES[product_type.behavior]
+
+
+def get_product_start_date(product):
+    return product.created_at.date() if product.created_at else date.today()
+
+
+def compute_product_schedule(product):
+    return compute_schedule(
+        product.amount, product.interest_rate, product.duration,
+        get_schedule_mode(product.type), get_product_start_date(product)
+    )
+
+
+def missing_installments(schedule, saved):
+    # saved — пары (номер платежа, дата) сохраненных строк; строки без номера сопоставляются по дате
+    numbers = {number for number, _ in saved if number}
+    dates = {scheduled_date for number, scheduled_date in saved if not number}
+    return [i for i in schedule if i.amount and i.number not in numbers and i.date not in dates]
+
+
+def split_payments(schedule, principal, payments):
+    # payments — тройки (номер платежа, дата, сумма) сохраненных строк; строка, совпадающая с расчетным платежом
+    # по номеру (без номера — по дате) и сумме, берет его основную часть, остальные (ручные и старые платежи)
+    # делят непогашенный остаток основного долга пропорционально сумме
+    by_number = {i.number: i for i in schedule if i.amount}
+    by_date = {i.date: i for i in schedule if i.amount}
+    principals = []
+    for number, scheduled_date, amount in payments:
+        installment = by_number.get(number) if number else by_date.get(scheduled_date)
+        principals.append(installment.principal if installment and installment.amount == amount else None)
+
+    unmatched = sum((amount for (_, _, amount), p in zip(payments, principals) if p is None), ZERO)
+    rest = _round(Decimal(principal)) - sum((p for p in principals if p is not None), ZERO)
+    share = min(max(rest, ZERO), unmatched) / unmatched if unmatched else ZERO
+    principals = [_round(amount * share) if p is None else p for (_, _, amount), p in zip(payments, principals)]
+    return [(amount - p, p) for (_, _, amount), p in zip(payments, principals)]
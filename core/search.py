@@ -0,0 +1,25 @@
+from django.db.models import Q
+
+def build_client_search_document(client):
+    parts = [client.work_place or "", client.birth_date.isoformat() if client.birth_date else ""]
+    contact = client.contact
+    if contact:
+        parts += [
+            contact.name, contact.phone,
+            f"{contact.passport_series} {contact.passport_number}",
+            f"{contact.passport_series}{contact.passport_number}",
+        ]
+    return " ".join(p.strip() for p in parts if p and p.strip()).lower()
+
+
+def client_search_q(search_term: str, prefix: str = "", id_fields=()):
+    tokens = search_term.lower().split()
+    query = Q()
+    for token in tokens:
+        query &= Q(**{f"{prefix}search_document__contains": token})
+
+    if search_term.strip().isdigit():
+        for field in id_fields:
+            query |= Q(**{field: int(search_term)})
+    return query
+
@@ -4,4 +4,21 @@ WKHTMLTOPDF_PATH = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltopdf.exe'
 PRODUCT_TYPES = {
     'deposit': 'депозит',
     'credit': 'кредит'
-}
\ No newline at end of file
+}
+PDF_WORKERS = 2
+PDF_RENDER_TIMEOUT = 120
+REPORT_CACHE_DIR = 'tmp/reports'
+REPORT_MAX_RUNNING_JOBS = 4
+REPORT_POLL_INTERVAL = 3
+PERMISSIONS_CACHE_TIMEOUT = 60 * 60
+APPROVAL_BATCH_LIMIT = 1000
+REFERENCES_CHECK_INTERVAL = 5
+API_PAGE_SIZE = 100
+API_MAX_PAGE_SIZE = 1000
+BENCHMARK_RESULTS_DIR = 'tmp/benchmarks'
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_SAMPLES = 1000
+INSTRUMENTATION_DUPLICATE_THRESHOLD = 5
+PARTITION_AHEAD = 12
+ARCHIVE_DIR = 'tmp/archive'
+ARCHIVE_PRODUCT_STATUSES = ['Закрыт']
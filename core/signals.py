@@ -0,0 +1,103 @@
+import threading
+
+from django.db import transaction
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from core.models import (
+    Client, Contact, Manager, Role, Product, PaymentSchedule, Transaction,
+    PaymentStatus, TransactionStatus, ProductStatus, ProductType, TransactionType
+)
+from core.portfolio import refresh_portfolios
+from core.references import references
+from core.search import build_client_search_document
+from core.utils import invalidate_permissions
+
+pending_refresh = threading.local()
+
+
+@receiver(m2m_changed, sender=Role.permissions.through)
+@receiver(m2m_changed, sender=Manager.user_permissions.through)
+def permissions_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(invalidate_permissions)
+
+
+@receiver(post_save, sender=Manager)
+def manager_saved(sender, update_fields=None, **kwargs):
+    if update_fields is None or 'role' in update_fields or 'is_active' in update_fields:
+        transaction.on_commit(invalidate_permissions)
+
+
+@receiver(post_delete, sender=Role)
+@receiver(post_delete, sender=Manager)
+def permissions_owner_deleted(sender, **kwargs):
+    transaction.on_commit(invalidate_permissions)
+
+
+@receiver(post_save, sender=Contact)
+def contact_saved(sender, instance, **kwargs):
+    for client in Client.objects.filter(contact=instance):
+        client.contact = instance
+        Client.objects.filter(pk=client.pk).update(search_document=build_client_search_document(client))
+
+
+@receiver(post_save, sender=Client)
+def client_saved(sender, instance, created, **kwargs):
+    if not created:
+        PaymentSchedule.objects.filter(client=instance).exclude(contact_id=instance.contact_id).update(
+            contact_id=instance.contact_id
+        )
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is not None and 'client' not in update_fields:
+        return
+    client = instance.client
+    Transaction.objects.filter(product=instance).exclude(client_id=client.id).update(client_id=client.id)
+    PaymentSchedule.objects.filter(product=instance).exclude(client_id=client.id, contact_id=client.contact_id).update(
+        client_id=client.id, contact_id=client.contact_id
+    )
+
+
+@receiver(post_save, sender=PaymentSchedule)
+@receiver(post_save, sender=Transaction)
+def payments_changed(sender, instance, **kwargs):
+    refresh_portfolios([instance.product_id])
+
+
+@receiver(post_delete, sender=PaymentSchedule)
+@receiver(post_delete, sender=Transaction)
+def payments_deleted(sender, instance, **kwargs):
+    # при каскадном удалении продукта его портфель удаляется раньше строк графика, поэтому пересчет
+    # откладывается до фиксации, выполняется один раз и только для продуктов, которые еще существуют
+    if not hasattr(pending_refresh, 'product_ids'):
+        pending_refresh.product_ids = set()
+    pending_refresh.product_ids.add(instance.product_id)
+    transaction.on_commit(refresh_pending_portfolios)
+
+
+def refresh_pending_portfolios():
+    product_ids, pending_refresh.product_ids = getattr(pending_refresh, 'product_ids', set()), set()
+    if product_ids:
+        refresh_portfolios(product_ids)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_portfolios([], [instance.client_id]))
+
+
+@receiver(post_save, sender=PaymentStatus)
+@receiver(post_save, sender=TransactionStatus)
+@receiver(post_save, sender=ProductStatus)
+@receiver(post_save, sender=ProductType)
+@receiver(post_save, sender=TransactionType)
+@receiver(post_delete, sender=PaymentStatus)
+@receiver(post_delete, sender=TransactionStatus)
+@receiver(post_delete, sender=ProductStatus)
+@receiver(post_delete, sender=ProductType)
+@receiver(post_delete, sender=TransactionType)
+def references_changed(sender, **kwargs):
+    transaction.on_commit(references.invalidate)
@@ -1,11 +1,30 @@
 from django.urls import path
 from django.http import HttpResponse
-from core.views import download_payment_schedule_report, approve_transaction
+from core.async_views import (
+    download_payment_schedule_report_async, download_report_job_async, approve_transaction_async,
+    approve_transactions_batch_async
+)
+from core.views import (
+    download_payment_schedule_report, download_report_job, export_payment_schedules, approve_transaction,
+    approve_transactions_batch, api_list, api_product_schedule
+)
 
 urlpatterns = [
+    path('transaction/approve/', approve_transactions_batch, name='transactions_approve_batch'),
     path('transaction/<int:transaction_id>/approve/', lambda request, transaction_id:
         approve_transaction(request, transaction_id, True), name='transaction_approve'),
     path('transaction/<int:transaction_id>/reject/', lambda request, transaction_id:
         approve_transaction(request, transaction_id, False), name='transaction_reject'),
-    path('report/<str:_type>/<int:product_id>', download_payment_schedule_report, name="product_report")
+    path('report/job/<int:job_id>', download_report_job, name="report_job_download"),
+    path('report/<str:_type>/<int:product_id>', download_payment_schedule_report, name="product_report"),
+    path('report/schedules/', export_payment_schedules, name="payment_schedules_export"),
+    path('async/transaction/approve/', approve_transactions_batch_async, name='transactions_approve_batch_async'),
+    path('async/transaction/<int:transaction_id>/approve/', approve_transaction_async, {'approve': True},
+         name='transaction_approve_async'),
+    path('async/transaction/<int:transaction_id>/reject/', approve_transaction_async, {'approve': False},
+         name='transaction_reject_async'),
+    path('async/report/job/<int:job_id>', download_report_job_async, name="report_job_download_async"),
+    path('async/report/<str:_type>/<int:product_id>', download_payment_schedule_report_async, name="product_report_async"),
+    path('products/<int:product_id>/schedule/', api_product_schedule, name="api_product_schedule"),
+    path('<slug:resource>/', api_list, name="api_list")
 ]
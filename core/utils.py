@@ -1,86 +1,162 @@
 import csv
-import pdfkit
-from jinja2 import Template
-from datetime import date, timedelta
+import time
+import heapq
+from datetime import date
+from itertools import chain, islice
 
-from core.settings import WKHTMLTOPDF_PATH, PRODUCT_TYPES
-from core.models import Product, PaymentSchedule, PaymentStatus
+from django.db import transaction, connection
+from django.core.cache import cache
+
+from core.portfolio import refresh_portfolios
+from core.references import references
+from core.schedule import compute_product_schedule, missing_installments, split_payments, ZERO
+from core.settings import PRODUCT_TYPES, PERMISSIONS_CACHE_TIMEOUT
+from core.models import Product, ProductType, PaymentSchedule, PaymentStatus, ProductPortfolio
+
+PERMISSIONS_VERSION_KEY = "core:permissions:version"
+
+
+def build_payment_schedule(product: Product, status: PaymentStatus):
+    return [
+        PaymentSchedule(
+            product=product, client_id=product.client_id, contact_id=product.client.contact_id,
+            installment=installment.number, amount=installment.amount, scheduled_date=installment.date, status=status
+        )
+        for installment in compute_product_schedule(product) if installment.amount
+    ]
+
+
+def is_lazy_schedule(product: Product):
+    product_type = references.get(ProductType, product.type_id)
+    return bool(product_type and product_type.lazy_schedule)
 
 
 def gen_payment_schedule(product: Product):
-    interest_rate = ((product.interest_rate / 100) / 12) * product.duration
-    if product.type.behavior == 'deposit':
-        profit = (product.amount * interest_rate) / product.duration
-        for month in range(1, product.duration + 1):
-            PaymentSchedule.objects.create(
-                product=product,
-                amount=profit + (product.amount if month == product.duration else 0),
-                scheduled_date=date.today() + timedelta(days=30 * month),
-                status=PaymentStatus.objects.get_or_create(name="Назначен")[0]
-            )
+    return gen_payment_schedules([product])
+
 
-    else:
-        interest_rate += 1
-        monthly_payment = (product.amount * interest_rate) / product.duration
-        for month in range(1, product.duration + 1):
-            PaymentSchedule.objects.create(
-                product=product,
-                amount=monthly_payment,
-                scheduled_date=date.today() + timedelta(days=30 * month),
-                status=PaymentStatus.objects.get_or_create(name="Назначен")[0]
+def gen_payment_schedules(products, batch_size: int = 1000):
+    status = references.get_or_create(PaymentStatus, "Назначен")
+    payments = []
+    for product in products:
+        if not is_lazy_schedule(product):
+            payments.extend(build_payment_schedule(product, status))
+    payments = PaymentSchedule.objects.bulk_create(payments, batch_size=batch_size)
+    refresh_portfolios([product.id for product in products])
+    return payments
+
+
+def get_payment_schedules(products, today: date = None):
+    """Графики платежей продуктов: сохраненные строки, а для продуктов с графиком по требованию —
+    дополненные несохраненными платежами, рассчитанными по условиям продукта"""
+    today = today or date.today()
+    schedules = {product.id: [] for product in products}
+    for payment in PaymentSchedule.objects.filter(product_id__in=schedules).order_by('scheduled_date', 'id'):
+        schedules[payment.product_id].append(payment)
+
+    scheduled, overdue = references.get_or_create(PaymentStatus, "Назначен"), references.get_or_create(PaymentStatus, "Просрочен")
+    for product in products:
+        if not is_lazy_schedule(product):
+            continue
+        saved = schedules[product.id]
+        saved.extend(
+            PaymentSchedule(
+                product=product, client_id=product.client_id, contact_id=product.client.contact_id,
+                installment=installment.number, amount=installment.amount, scheduled_date=installment.date,
+                status=overdue if installment.date < today else scheduled
             )
+            for installment in missing_installments(
+                compute_product_schedule(product), [(p.installment, p.scheduled_date) for p in saved]
+            )
+        )
+        saved.sort(key=lambda p: (p.scheduled_date, p.installment or 0))
+    return schedules
+
+
+def get_payment_schedule(product: Product):
+    return get_payment_schedules([product])[product.id]
+
+
+def materialize_payment(product: Product, installment: int):
+    with transaction.atomic():
+        # блокировка продукта исключает повторное сохранение одного платежа параллельными запросами
+        list(Product.objects.select_for_update().filter(pk=product.pk).values_list('pk'))
+        payment = next((p for p in get_payment_schedule(product) if p.installment == installment), None)
+        if payment is not None and payment.pk is None:
+            payment.save()
+    return payment
+
 
+def mark_overdue_payments(today: date = None, chunk_size: int = 10000):
+    today = today or date.today()
+    overdue = references.get_or_create(PaymentStatus, "Просрочен")
+    candidates = PaymentSchedule.objects.filter(scheduled_date__lt=today, transaction__isnull=True).exclude(status=overdue)
 
-def get_payment_schedule_table(product: Product):
+    stats = {"updated": 0, "chunks": 0, "products": 0}
+    started = time.perf_counter()
+    while True:
+        rows = list(candidates.values_list('id', 'product_id')[:chunk_size])
+        if not rows:
+            break
+        with transaction.atomic():
+            stats["updated"] += PaymentSchedule.objects.filter(id__in=[r[0] for r in rows]).update(status=overdue)
+            product_ids = {r[1] for r in rows}
+            refresh_portfolios(product_ids)
+        stats["chunks"] += 1
+        stats["products"] += len(product_ids)
 
-    schedule = PaymentSchedule.objects.filter(product=product)
+    # у графиков по требованию просрочка не хранится в строках, поэтому пересчитываются портфели
+    # продуктов, ближайший платеж которых уже наступил
+    lazy_products = ProductPortfolio.objects.filter(
+        product__type__lazy_schedule=True, next_due_date__lt=today
+    ).order_by('product_id').values_list('product_id', flat=True)
+    last_id = 0
+    while product_ids := list(lazy_products.filter(product_id__gt=last_id)[:chunk_size]):
+        refresh_portfolios(product_ids)
+        last_id = product_ids[-1]
+        stats["chunks"] += 1
+        stats["products"] += len(product_ids)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+def get_payment_schedule_table(product: Product, payments=None):
+    # таблица строится по сохраненному графику (у графиков по требованию — дополненному расчетом),
+    # разбивка на проценты и основной долг берется из расчета для совпадающих с ним платежей;
+    # payments — уже загруженный график продукта (см. get_payment_schedules)
+    payments = get_payment_schedule(product) if payments is None else payments
+    splits = split_payments(
+        compute_product_schedule(product), product.amount, [(p.installment, p.scheduled_date, p.amount) for p in payments]
+    )
 
     data = []
-    amount_paid = 0
-    remaining_amount = sum([p.amount for p in schedule])
-    for i, payment in enumerate(schedule):
-        amount_paid += payment.amount
-        current_remaining_amount = remaining_amount - amount_paid
-        current_interest_amount = current_remaining_amount - product.amount
-        current_main_amount = product.amount if current_interest_amount > 0 else (
-                product.amount + current_interest_amount)
-
-        data.append([
-            i + 1, payment.scheduled_date, payment.amount,
-            str(current_interest_amount if current_interest_amount > 0 else 0) + "₽",
-            str(current_main_amount) + "₽",
-            str(current_remaining_amount) + "₽"
-        ])
+    debt = sum((payment.amount for payment in payments), ZERO)
+    for i, (payment, (interest, principal)) in enumerate(zip(payments, splits)):
+        debt -= payment.amount
+        data.append([i + 1, payment.scheduled_date, payment.amount, f"{interest}₽", f"{principal}₽", f"{debt}₽"])
 
     return {
         "table": [[
             "№", "Запланированная дата платежа", "Сумма платежа",
             "Проценты", "Основная сумма", "Общий долг"
         ], *data],
-        "interest_amount": remaining_amount - product.amount
+        "interest_amount": sum((interest for interest, _ in splits), ZERO)
     }
 
 
-def generate_payment_schedule_pdf(product: Product, filename: str):
-    config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
-    data = get_payment_schedule_table(product)
-    pdfkit.from_string(Template(open(
-        "./core/templates/core/pdf_report.html", "r", encoding="utf-8"
-    ).read()).render(
-        data=data['table'],
-        product_id=product.id,
-        client_name=product.client.contact.name,
-        client_phone=product.client.contact.phone,
-        product_type=PRODUCT_TYPES[product.type.behavior],
-        product_amount=product.amount,
-        interest_rate=product.interest_rate,
-        product_duration=product.duration,
-        interest_amount=data['interest_amount']
-    ), filename, configuration=config)
-    return filename
-
-def generate_payment_schedule_csv(product: Product, filename: str):
-    data = get_payment_schedule_table(product)
+class Echo:
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo(), delimiter="\t", lineterminator="\n")
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_payment_schedule_csv(product: Product, payments=None):
+    data = get_payment_schedule_table(product, payments)
     extra_data = [
         [f"График платежей по договору №{product.id}"],
         ["Клиент", product.client.contact.name],
@@ -90,15 +166,95 @@ def generate_payment_schedule_csv(product: Product, filename: str):
         ["Начисления", f"{data['interest_amount']}₽"],
         ["Срок договора", f"{product.duration} месяца(ев)"],
     ]
+    return iter_csv(chain(extra_data, data['table']))
+
+
+def iter_lazy_payment_schedule_rows(products, date_from: date = None, date_to: date = None, chunk_size: int = 200):
+    products = products.select_related('type', 'client__contact').order_by('id').iterator(chunk_size=chunk_size)
+    while chunk := list(islice(products, chunk_size)):
+        schedules = get_payment_schedules(chunk)
+        for product in chunk:
+            for payment in schedules[product.id]:
+                if date_from and payment.scheduled_date < date_from or date_to and payment.scheduled_date > date_to:
+                    continue
+                status = references.get(PaymentStatus, payment.status_id)
+                yield (
+                    product.id, product.client_id, product.client.contact.name if product.client.contact else None,
+                    payment.scheduled_date, payment.amount, payment.actual_date, status.name if status else None,
+                    payment.transaction_id
+                )
+
 
-    csv_data = []
-    for row in [*extra_data, *data['table']]:
-        csv_data.append("\t".join([str(el) for el in row]))
+def stream_payment_schedules_csv(queryset, lazy_products=None, date_from: date = None, date_to: date = None,
+                                 chunk_size: int = 2000):
+    rows = queryset.order_by('product_id', 'scheduled_date', 'id').values_list(
+        'product_id', 'client_id', 'contact__name', 'scheduled_date', 'amount', 'actual_date', 'status__name', 'transaction_id'
+    ).iterator(chunk_size=chunk_size)
+    if lazy_products is not None:
+        rows = heapq.merge(rows, iter_lazy_payment_schedule_rows(lazy_products, date_from, date_to), key=lambda r: r[0])
+    return iter_csv(chain([[
+        "Продукт", "ID клиента", "Клиент", "Запланированная дата платежа", "Сумма платежа",
+        "Фактическая дата платежа", "Статус", "Транзакция"
+    ]], rows))
 
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write("\n".join(csv_data))
 
-    return filename
+def invalidate_permissions():
+    try:
+        cache.incr(PERMISSIONS_VERSION_KEY)
+    except ValueError:
+        cache.set(PERMISSIONS_VERSION_KEY, 1, None)
+
+
+def get_permission_codenames(user):
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_permission_codenames'):
+        # версия и права пользователя читаются из общего кэша одним обращением,
+        # права, сохраненные при другой версии, считаются устаревшими
+        key = f"core:permissions:{user.pk}"
+        cached = cache.get_many([PERMISSIONS_VERSION_KEY, key])
+        version = cached.get(PERMISSIONS_VERSION_KEY)
+        if version is None:
+            version = cache.get_or_set(PERMISSIONS_VERSION_KEY, 1, None)
+        cached_version, codenames = cached.get(key, (None, None))
+        if cached_version != version:
+            codenames = frozenset(
+                p.split('.', 1)[-1] if isinstance(p, str) else p.codename for p in user.get_user_permissions()
+            )
+            cache.set(key, (version, codenames), PERMISSIONS_CACHE_TIMEOUT)
+        user._permission_codenames = codenames
+    return user._permission_codenames
+
+
+def bulk_update_values(model, fields, rows, batch_size: int = 1000):
+    columns = [model._meta.get_field(name) for name in fields]
+    quote = connection.ops.quote_name
+    table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+    assignments = ", ".join(f"{quote(field.column)} = v.column{i + 2}" for i, field in enumerate(columns))
+    # PostgreSQL выводит типы столбцов VALUES из параметров: даты и столбцы из одних NULL получаются text
+    casts = [
+        f"::{field.db_type(connection)}" if connection.vendor == 'postgresql' else ""
+        for field in [model._meta.pk, *columns]
+    ]
+    row_placeholder = f"({', '.join(f'%s{cast}' for cast in casts)})"
+
+    rows = list(rows)
+    updated = 0
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), batch_size):
+            batch = rows[offset:offset + batch_size]
+            params = []
+            for pk_value, *values in batch:
+                params.append(pk_value)
+                params.extend(field.get_db_prep_value(value, connection) for field, value in zip(columns, values))
+            cursor.execute(
+                f"UPDATE {table} SET {assignments} FROM (VALUES {', '.join([row_placeholder] * len(batch))}) AS v "
+                f"WHERE {table}.{pk} = v.column1",
+                params
+            )
+            updated += cursor.rowcount
+    return updated
+
 
 def check_permission(permission, user):
-    return permission in [e.codename for e in list(user.get_user_permissions())]
\ No newline at end of file
+    return permission in get_permission_codenames(user)
@@ -1,48 +1,230 @@
+import os
+import json
 from datetime import date
+from collections import Counter
 
-from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.shortcuts import get_object_or_404, render
+from django.contrib import admin
+from django.views.decorators.http import require_GET, require_POST
+from django.utils.cache import get_conditional_response, patch_cache_control, set_response_etag
 from django.core.exceptions import PermissionDenied
-from django.http import HttpResponse, HttpResponseRedirect
+from django.utils.dateparse import parse_date
+from django.http import (
+    Http404, HttpResponse, HttpResponseRedirect, StreamingHttpResponse, FileResponse, JsonResponse
+)
 from django.contrib.auth.decorators import user_passes_test
 
-from core.models import Product, Transaction, TransactionStatus
-from core.utils import generate_payment_schedule_pdf, generate_payment_schedule_csv, check_permission
+from core.api import RESOURCES, ApiError, get_page
+from core.instrumentation import registry
+from core.approvals import approve_transactions, ALREADY_PROCESSED, NOT_FOUND
+from core.jobs import enqueue_report
+from core.models import Product, PaymentSchedule, PaymentStatus, ReportJob
+from core.references import references
+from core.reports import get_cached_payment_schedule_pdf
+from core.settings import (
+    REPORT_POLL_INTERVAL, APPROVAL_BATCH_LIMIT, API_PAGE_SIZE, API_MAX_PAGE_SIZE, INSTRUMENTATION_ENABLED
+)
+from core.utils import (
+    stream_payment_schedule_csv, stream_payment_schedules_csv, check_permission, get_payment_schedule
+)
 
 
 @user_passes_test(lambda u: u.is_staff)
 def download_payment_schedule_report(request, product_id: int, _type: str):
     _type = _type.lower().strip()
-    action = {
-        'csv': {'generate': generate_payment_schedule_csv, 'content_type': "application/pdf"},
-        'pdf': {'generate': generate_payment_schedule_pdf, 'content_type': "text/csv"},
-    }.get(_type)
-
-    if action:
-        try:
-            product = Product.objects.get(id=product_id)
-            filename = f"tmp/ps_{product.id}_{date.today()}.{_type}"
-            action['generate'](product, filename)
-
-            with open(filename, 'rb') as pdf_file:
-                response = HttpResponse(pdf_file.read(), content_type=action['content_type'])
-                response['Content-Disposition'] = f'attachment; filename="{filename}"'
-                return response
-        except Product.DoesNotExist:
-            return HttpResponse("Продукт не найден.", status=404)
-    return HttpResponse("Некорректный формат файла.", status=400)
+    if _type not in ('csv', 'pdf'):
+        return HttpResponse("Некорректный формат файла.", status=400)
+
+    try:
+        product = Product.objects.select_related('type', 'client__contact').get(id=product_id)
+    except Product.DoesNotExist:
+        return HttpResponse("Продукт не найден.", status=404)
+
+    filename = f"ps_{product.id}_{date.today()}.{_type}"
+    if _type == 'csv':
+        response = StreamingHttpResponse(stream_payment_schedule_csv(product), content_type="text/csv")
+    else:
+        path = get_cached_payment_schedule_pdf(product)
+        if path is None:
+            job = enqueue_report(product, _type, request.user)
+            return HttpResponseRedirect(reverse('report_job_download', args=[job.id]))
+        response = FileResponse(open(path, 'rb'), content_type="application/pdf")
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@user_passes_test(lambda u: u.is_staff)
+def download_report_job(request, job_id: int):
+    return report_job_response(get_object_or_404(ReportJob, id=job_id))
+
+
+def report_job_response(job: ReportJob):
+    if job.status in (ReportJob.QUEUED, ReportJob.RUNNING):
+        response = HttpResponse(
+            f"Отчет {job.get_status_display().lower()}. Страница обновится автоматически.", status=202
+        )
+        response['Refresh'] = str(REPORT_POLL_INTERVAL)
+        return response
+    if job.status == ReportJob.FAILED:
+        return HttpResponse("Не удалось сформировать отчет.", status=500)
+    if not os.path.exists(job.file):
+        return HttpResponse("Файл отчета устарел, сформируйте отчет повторно.", status=410)
+
+    if job.is_archive:
+        response = FileResponse(open(job.file, 'rb'), content_type="application/zip")
+        response['Content-Disposition'] = f'attachment; filename="reports_{job.report_type}_{job.created_at.date()}.zip"'
+        return response
+    response = FileResponse(open(job.file, 'rb'), content_type={'pdf': "application/pdf", 'csv': "text/csv"}[job.report_type])
+    response['Content-Disposition'] = f'attachment; filename="ps_{job.product_id}_{job.created_at.date()}.{job.report_type}"'
+    return response
+
+
+@user_passes_test(lambda u: u.is_staff)
+def export_payment_schedules(request):
+    queryset = PaymentSchedule.objects.exclude(product__type__lazy_schedule=True)
+    lazy_products = Product.objects.filter(type__lazy_schedule=True)
+
+    product_ids = [p for e in request.GET.getlist('product') for p in e.split(',') if p]
+    if product_ids:
+        if not all(p.isdigit() for p in product_ids):
+            return HttpResponse("Некорректный ID продукта.", status=400)
+        queryset = queryset.filter(product_id__in=product_ids)
+        lazy_products = lazy_products.filter(id__in=product_ids)
+
+    dates = {}
+    for param, lookup in (('date_from', 'scheduled_date__gte'), ('date_to', 'scheduled_date__lte')):
+        if request.GET.get(param):
+            try:
+                value = parse_date(request.GET[param])
+            except ValueError:
+                value = None
+            if value is None:
+                return HttpResponse("Некорректная дата.", status=400)
+            queryset = queryset.filter(**{lookup: value})
+            dates[param] = value
+
+    response = StreamingHttpResponse(
+        stream_payment_schedules_csv(queryset, lazy_products, **dates), content_type="text/csv"
+    )
+    response['Content-Disposition'] = f'attachment; filename="payment_schedules_{date.today()}.csv"'
+    return response
 
 
 @user_passes_test(lambda u: u.is_staff)
 def approve_transaction(request, transaction_id, approve=True):
     if check_permission('approve_transaction', request.user):
-        transaction = get_object_or_404(Transaction, id=transaction_id)
-        if transaction.approved is not None:
+        result = approve_transactions([transaction_id], approve, request.user)[transaction_id]
+        if result == NOT_FOUND:
+            raise Http404()
+        if result == ALREADY_PROCESSED:
             return HttpResponse("Транзакция уже обработана.", status=400)
-
-        transaction.approved = approve
-        if not approve:
-            transaction.status = TransactionStatus.objects.get_or_create(name="Отменено")[0]
-        transaction.approved_by = request.user
-        transaction.save()
         return HttpResponseRedirect(request.META.get('HTTP_REFERER'))
-    raise PermissionDenied()
\ No newline at end of file
+    raise PermissionDenied()
+
+
+@require_POST
+@user_passes_test(lambda u: u.is_staff)
+def approve_transactions_batch(request):
+    if not check_permission('approve_transaction', request.user):
+        return JsonResponse({"error": "Недостаточно прав."}, status=403)
+
+    try:
+        approve, ids = parse_approval_request(request)
+    except ApiError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    return approval_response(approve_transactions(ids, approve, request.user))
+
+
+def parse_approval_request(request):
+    try:
+        data = json.loads(request.body) if request.content_type == "application/json" else request.POST
+        action = data.get('action')
+        ids = data['ids'] if isinstance(data.get('ids'), list) else [i for e in data.getlist('ids') for i in e.split(',') if i]
+        ids = [int(i) for i in ids]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ApiError("Некорректный запрос.")
+    if action not in ('approve', 'reject') or not ids:
+        raise ApiError("Укажите action (approve/reject) и ids.")
+    if len(ids) > APPROVAL_BATCH_LIMIT:
+        raise ApiError(f"Не более {APPROVAL_BATCH_LIMIT} транзакций за запрос.")
+    return action == 'approve', ids
+
+
+def approval_response(results: dict):
+    return JsonResponse({
+        "results": [{"id": i, "result": result} for i, result in results.items()],
+        "counts": dict(Counter(results.values())),
+    })
+
+
+@require_GET
+@user_passes_test(lambda u: u.is_staff)
+def api_list(request, resource: str):
+    if resource not in RESOURCES:
+        return JsonResponse({"error": "Ресурс не найден."}, status=404)
+    resource = RESOURCES[resource]
+    if not check_permission(f"view_{resource.model._meta.model_name}", request.user):
+        return JsonResponse({"error": "Недостаточно прав."}, status=403)
+
+    try:
+        limit = min(int(request.GET.get('limit', API_PAGE_SIZE)), API_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({"error": "Некорректный limit."}, status=400)
+    try:
+        results, cursor = get_page(resource, request.GET, limit)
+    except ApiError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    next_url = None
+    if cursor:
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+    response = JsonResponse({"results": results, "next": next_url}, json_dumps_params={"ensure_ascii": False})
+    set_response_etag(response)
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+@require_GET
+@user_passes_test(lambda u: u.is_staff)
+def api_product_schedule(request, product_id: int):
+    if not check_permission("view_paymentschedule", request.user):
+        return JsonResponse({"error": "Недостаточно прав."}, status=403)
+    product = Product.objects.select_related('type').filter(id=product_id).first()
+    if product is None:
+        return JsonResponse({"error": "Продукт не найден."}, status=404)
+
+    results = []
+    for payment in get_payment_schedule(product):
+        status = references.get(PaymentStatus, payment.status_id)
+        results.append({
+            "id": payment.id,
+            "installment": payment.installment,
+            "amount": payment.amount,
+            "scheduled_date": payment.scheduled_date,
+            "actual_date": payment.actual_date,
+            "status": status.name if status else None,
+            "transaction": payment.transaction_id,
+        })
+    response = JsonResponse({"product": product.id, "results": results}, json_dumps_params={"ensure_ascii": False})
+    set_response_etag(response)
+    patch_cache_control(response, private=True, no_cache=True)
+    return get_conditional_response(request, etag=response['ETag'], response=response)
+
+
+def instrumentation_report(request):
+    if not request.user.is_superuser:
+        raise PermissionDenied()
+    if request.method == 'POST':
+        registry.clear()
+        return HttpResponseRedirect(request.path)
+    return render(request, 'admin/core/instrumentation.html', {
+        **admin.site.each_context(request),
+        'title': "Производительность запросов",
+        'enabled': INSTRUMENTATION_ENABLED,
+        'views': registry.summary(),
+    })
\ No newline at end of file